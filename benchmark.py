@@ -0,0 +1,185 @@
+# Benchmarks for the stages of PEARL (preprocess, approximate, subsume, eliminate, simplify, translate)
+# python benchmark.py [--suite axioms|families|random|all] [--seed 0] [--count 20] [--depth 4]
+# reports time, peak memory and number of formula nodes produced by each stage for each input
+
+import argparse, json, random, sys, time, tracemalloc
+import pearl
+
+# Standard relevance logic axioms (and a few frame conditions of interest)
+AXIOMS = {
+  "self-implication": r"p\to p",
+  "contraction": r"(p\to(p\to q))\to(p\to q)",
+  "permutation": r"(p\to(q\to r))\to(q\to(p\to r))",
+  "assertion": r"p\to((p\to q)\to q)",
+  "prefixing": r"(p\to q)\to((r\to p)\to(r\to q))",
+  "suffixing": r"(p\to q)\to((q\to r)\to(p\to r))",
+  "conjunction intro": r"(p\to q)\land(p\to r)\to(p\to q\land r)",
+  "disjunction elim": r"(p\to r)\land(q\to r)\to(p\lor q\to r)",
+  "distribution": r"p\land(q\lor r)\to(p\land q)\lor(p\land r)",
+  "double negation": r"\sim\sim p\to p",
+  "double negation intro": r"p\to\sim\sim p",
+  "reductio": r"(p\to\sim p)\to\sim p",
+  "contraposition": r"(p\to\sim q)\to(q\to\sim p)",
+  "excluded middle": r"p\lor\sim p",
+  "commutativity": r"p\circ q\le q\circ p",
+  "associativity": r"p\circ(q\circ r)\le(p\circ q)\circ r",
+  "square increasing": r"p\le p\circ p",
+  "square decreasing": r"p\circ p\le p",
+  "weakening": r"p\to(q\to p)",
+  "linearity": r"(p\to q)\lor(q\to p)",
+  "pseudo modus ponens": r"p\land(p\to q)\to q",
+}
+
+# Scaling families: name -> function from depth n >= 1 to a formula
+def nested(op, n, leaf="p", last="q"): # leaf op (leaf op (... op last))
+  return "("+leaf+op+" "+nested(op, n-1, leaf, last)+")" if n>0 else last
+
+FAMILIES = {
+  "circ": lambda n: r"p\le "+nested("\\circ", n),                        # p <= p o (p o ... q)
+  "to": lambda n: nested("\\to", n)+r"\to(p\to q)",                      # generalized contraction
+  "land-lor": lambda n: nested("\\land", n, "(p\\lor q)", "r")+r"\le r\lor"+nested("\\lor", n, "p", "q"),
+  "sim": lambda n: "\\sim "*(2*n)+r"p\to p",                             # iterated double negation
+}
+
+# Random Sahlqvist and inductive formulas s <= t (signed generation trees +s, -t)
+# skeleton nodes (for the sign of the node) can be nested freely above a critical occurrence,
+# PIA nodes (SRA, SRR) only below skeleton nodes; side branches of SRR nodes only contain
+# non-critical occurrences of smaller variables (this gives the dependency order)
+# the inductive ones are drawn until pearl.classify finds them inductive but not Sahlqvist
+
+SKELETON = {True:[pearl.Mult, pearl.Meet, pearl.Join, pearl.Invol],  # +o, +^, +v, +~
+            False:[pearl.Meet, pearl.Join, pearl.Rimp, pearl.Invol]} # -^, -v, -->, -~
+PIA = {True:[pearl.Meet, pearl.Invol, pearl.Rimp],                    # +^ (SRA), +~ (SRA), +-> (SRR)
+       False:[pearl.Join, pearl.Invol, pearl.Mult]}                   # -v (SRA), -~ (SRA), -o (SRR)
+VARIABLES = ["p","q","r"]+["p_"+str(i) for i in range(1,10)]
+
+def child_signs(op, sign): # signs of the arguments of op under a node with this sign
+  if op==pearl.Invol: return [not sign]
+  if op==pearl.Rimp: return [not sign, sign]
+  return [sign, sign]
+
+def wrap(op, args): # LaTeX string of op applied to argument strings
+  if op==pearl.Invol: return "\\sim("+args[0]+")"
+  return "("+args[0]+")"+op+" ("+args[1]+")"
+
+def uniform(rng, sign, depth, vars): # subformula in which all variable occurrences are negative (non-critical)
+  if depth==0 or rng.random()<0.3:
+    if sign or vars==[]: return rng.choice(["\\mathbf t","\\top","\\bot"])
+    return rng.choice(vars)
+  op = rng.choice([pearl.Mult, pearl.Meet, pearl.Join, pearl.Rimp, pearl.Invol])
+  return wrap(op, [uniform(rng, s, depth-1, vars) for s in child_signs(op, sign)])
+
+def pia(rng, sign, depth, i, inductive): # PIA part above a critical occurrence of VARIABLES[i]
+  if depth==0 or rng.random()<0.3:
+    return VARIABLES[i] if sign else "\\sim "+VARIABLES[i]
+  ops = PIA[sign] if inductive else [op for op in PIA[sign] if op in (pearl.Meet,pearl.Join,pearl.Invol)]
+  op = rng.choice(ops)
+  signs = child_signs(op, sign)
+  if op==pearl.Invol: return wrap(op, [pia(rng, signs[0], depth-1, i, inductive)])
+  k = rng.randrange(2) if op in (pearl.Meet,pearl.Join) else (1 if op==pearl.Rimp else rng.randrange(2))
+  if inductive and op!=pearl.Meet and op!=pearl.Join and i>0 and not signs[1-k]:
+    side = rng.choice(VARIABLES[:i]) # an SRR side branch with a smaller variable
+  else: side = uniform(rng, signs[1-k], depth-1, VARIABLES[:i]) # only smaller variables in side branches
+  args = [None, None]
+  args[k] = pia(rng, signs[k], depth-1, i, inductive)
+  args[1-k] = side
+  return wrap(op, args)
+
+def skeleton(rng, sign, depth, nvars, inductive): # skeleton part of a signed generation tree
+  if depth==0 or rng.random()<0.2:
+    i = rng.randrange(nvars)
+    if sign: return pia(rng, sign, rng.randrange(depth+1), i, inductive)
+    return uniform(rng, sign, rng.randrange(depth+1), VARIABLES[:nvars])
+  op = rng.choice(SKELETON[sign])
+  return wrap(op, [skeleton(rng, s, depth-1, nvars, inductive) for s in child_signs(op, sign)])
+
+def random_formula(rng, depth=4, nvars=3, inductive=True): # random Sahlqvist (or inductive) inequality
+  # with inductive=True, candidates are drawn until one is inductive but not Sahlqvist (see pearl.classify)
+  while True:
+    st = skeleton(rng, True, depth, nvars, inductive)+"\\le "+skeleton(rng, False, depth, nvars, inductive)
+    if not inductive or pearl.classify(st)["class"]=="inductive": return st
+
+def random_formulas(seed=0, count=20, depth=4, nvars=3): # reproducible list of (name, formula)
+  rng = random.Random(seed)
+  return [("random "+str(seed)+"."+str(k), random_formula(rng, depth, nvars, k%2==1)) for k in range(count)]
+
+### Measurements ###############################################
+
+def nodes(A): # number of formula nodes in a stage result (formula, list of them, or string)
+  if type(A)==str: return 0
+  if type(A) in (list,tuple): return sum(nodes(B) for B in A)
+  return A.n
+
+STAGES = [("preprocess", lambda st: pearl.preprocess(st,False)),
+          ("approximate", lambda As: pearl.approximate(As,False)),
+          ("subsume", lambda As: pearl.subsume(As,False)),
+          ("eliminate", lambda As: pearl.eliminate(As,False)),
+          ("simplify", lambda As: pearl.simplify(As,False)),
+          ("translate", lambda As: pearl.reduce(pearl.translate(As)))]
+
+def run_stages(st, memory=False): # list of (stage, seconds, peak bytes or None, nodes) and the result
+  pearl.reset()
+  rows = []
+  A = st
+  for name, f in STAGES:
+    if memory: tracemalloc.start()
+    t = time.perf_counter()
+    A = f(A)
+    t = time.perf_counter()-t
+    peak = None
+    if memory:
+      peak = tracemalloc.get_traced_memory()[1]
+      tracemalloc.stop()
+    rows.append((name, t, peak, nodes(A)))
+  return rows, A
+
+def measure(st, repeat=3): # per-stage minimum time over repeat runs, peak memory of a separate run
+  runs = [run_stages(st)[0] for i in range(repeat)]
+  mem, A = run_stages(st, True)
+  return [{"stage":name, "time":min(r[k][1] for r in runs), "peak":mem[k][2], "nodes":mem[k][3]}
+          for k,(name,f) in enumerate(STAGES)], A
+
+def inputs(suite, seed, count, depth, maxdepth): # list of (name, formula) for a suite
+  if suite=="axioms": return list(AXIOMS.items())
+  if suite=="families":
+    return [(name+" "+str(n), f(n)) for name,f in FAMILIES.items() for n in range(1,maxdepth+1)]
+  if suite=="random": return random_formulas(seed, count, depth)
+  return inputs("axioms",seed,count,depth,maxdepth)+inputs("families",seed,count,depth,maxdepth)+\
+         inputs("random",seed,count,depth,maxdepth)
+
+def main(argv=None):
+  ap = argparse.ArgumentParser(description="Time, peak memory and node counts for each stage of PEARL")
+  ap.add_argument("--suite", choices=["axioms","families","random","all"], default="all")
+  ap.add_argument("--seed", type=int, default=0, help="seed of the random formula generator")
+  ap.add_argument("--count", type=int, default=20, help="number of random formulas")
+  ap.add_argument("--depth", type=int, default=4, help="depth of random formulas")
+  ap.add_argument("--maxdepth", type=int, default=8, help="largest depth of the scaling families")
+  ap.add_argument("--repeat", type=int, default=3, help="timing runs per formula (minimum is reported)")
+  ap.add_argument("--json", action="store_true", help="write one JSON line per formula instead of a table")
+  args = ap.parse_args(argv)
+  out = sys.stdout
+  sys.stdout = sys.stderr # keep messages printed by pearl out of the report
+  totals = {name:[0.0,0,0] for name,f in STAGES}
+  try:
+    if not args.json:
+      out.write("%-28s" % "formula"+"".join("%12s %8s %7s" % (name[:11],"KiB","nodes") for name,f in STAGES)+
+                "  result\n")
+    for name, st in inputs(args.suite, args.seed, args.count, args.depth, args.maxdepth):
+      rows, A = measure(st, args.repeat)
+      status = "failed" if type(A)==str else "ok"
+      for r in rows:
+        t = totals[r["stage"]]; t[0] += r["time"]; t[1] = max(t[1], r["peak"]); t[2] += r["nodes"]
+      if args.json:
+        out.write(json.dumps({"name":name, "input":st, "status":status, "stages":rows})+"\n")
+      else:
+        out.write("%-28s" % name[:28]+"".join("%10.2fms %8.1f %7d" % (1000*r["time"],r["peak"]/1024,r["nodes"])
+                  for r in rows)+"  "+status+"\n")
+      out.flush()
+    if not args.json:
+      out.write("%-28s" % "total (max KiB)"+"".join("%10.2fms %8.1f %7d" % (1000*t[0],t[1]/1024,t[2])
+                for t in totals.values())+"\n")
+  finally:
+    sys.stdout = out
+
+if __name__ == "__main__":
+  main()
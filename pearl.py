@@ -2,7 +2,13 @@
 # implementation by Peter Jipsen (jipsen@chapman.edu) 2021/02/16-05/19 (current version)
 # in collaboration with Willem Conradie and Valentin Goranko
 
-from IPython.display import display, Math
+import contextvars, os, re, signal, threading, time
+from sys import intern
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice, product
+from functools import lru_cache, partial, wraps
+from weakref import WeakKeyDictionary, WeakValueDictionary
 
 # Signature for input and output (the LaTeX symbols can be changed to agree with other conventions)
 # Relevance logic symbols and corresponding Routley-Meyer frame symbols (prefixed by RM, only for output)
@@ -43,84 +49,278 @@ PN0 = [t[0] for t in POSNEG]
 
 symbol_table = {}
 
-def wrap(subt, t): # decide when to add parentheses during printing of terms
-    return subt.tex() if subt.lbp > t.lbp or len(subt.a)<=1 else "("+subt.tex()+")"
-
-class symbol_base(object):
-    a = []
-    def __repr__(self): 
+class formula(object): # compact formula node: interned identifier, binding power, tuple of arguments
+    # formulas are hash-consed by fm(), so structurally equal formulas are the same object
+    # and the built-in identity hash and equality of objects can be used
+    __slots__ = ("id","lbp","a","n","__weakref__") # n is the number of nodes in the formula tree
+    def __init__(self, id, lbp=0, a=()):
+        self.id = id
+        self.lbp = lbp
+        self.a = a
+        self.n = 1+sum(B.n for B in a)
+    def __reduce__(self): # copies and unpickled formulas are hash-consed again
+        return (unflatten, (flatten(self),)) # a flat list, so deep formulas can be pickled
+    def __repr__(self):
         return self.tex()
-    def tex(self):
-        if len(self.a) == 0: return self.id
-        if len(self.a) == 1: 
-          if self.id[0]=="^": return wrap(self.a[0],self)+self.id
-          return self.id+" "+wrap(self.a[0],self)
-        if len(self.a) == 2: 
-          return wrap(self.a[0],self)+self.id+(" " if self.id[0]=='\\' else "")+wrap(self.a[1],self)
-        return self.id+" "+self.a[0].id+self.a[1].id+self.a[2].id
+    def tex(self): # the pieces are generated with an explicit stack (no recursion) and joined once
+        out = []
+        stack = [self] # strings and subformulas still to be printed, the next one last
+        while stack:
+          A = stack.pop()
+          if type(A) is str: out.append(A)
+          elif len(A.a) == 0: out.append(A.id)
+          elif len(A.a) == 1:
+            B = A.a[0] # parentheses unless B binds tighter than A or has at most one argument
+            Bs = [B] if B.lbp > A.lbp or len(B.a)<=1 else ["(",B,")"]
+            if A.id[0]=="^": stack += [A.id]+Bs[::-1]
+            else: stack += Bs[::-1]+[A.id+" "]
+          elif len(A.a) == 2:
+            B, C = A.a
+            stack += [C] if C.lbp > A.lbp or len(C.a)<=1 else [")",C,"("]
+            stack.append(A.id+(" " if A.id[0]=='\\' else ""))
+            stack += [B] if B.lbp > A.lbp or len(B.a)<=1 else [")",B,"("]
+          else: out.append(A.id+" "+A.a[0].id+A.a[1].id+A.a[2].id)
+        return "".join(out)
+
+formula_table = WeakValueDictionary() # (id, args) -> unique formula object
+formula_lock = threading.Lock()
+
+def fm(id, arg): # build (or look up) the unique formula with this identifier and argument formulas
+  key = (id, tuple(arg))
+  A = formula_table.get(key)
+  if A is None:
+    with formula_lock: # another thread may be building the same formula
+      A = formula_table.get(key)
+      if A is None:
+        s = symbol_table.get(id)
+        A = formula(intern(id), s.lbp if s else 0, key[1])
+        formula_table[key] = A
+        S = context().stats
+        if S is not None: S["fm"] += 1
+  return A
+
+# Traversals use an explicit stack instead of recursion, so deep (machine generated) formulas
+# do not exceed the Python recursion limit
+
+def fold(A, f, memo=None): # f(B, [results for the arguments of B]) for the subformulas B of A, bottom-up
+  # each shared subformula is visited once; memo (subformula -> result) can be reused between calls
+  if memo is None: memo = {}
+  stack = [A]
+  while stack:
+    B = stack.pop()
+    if B in memo: continue
+    for C in B.a:
+      if C not in memo: # visit B again after its arguments
+        stack.append(B); stack += B.a
+        break
+    else: memo[B] = f(B, [memo[C] for C in B.a])
+  return memo[A]
+
+def trampoline(gen, A): # run the recursive generator function gen on A without recursion
+  # gen(A) yields the arguments of its recursive calls and receives their results, i.e. it is written
+  # like a recursive function with (yield B) in place of a call on B; the calls run in the same order
+  stack = [gen(A)]
+  R = None
+  while stack:
+    try:
+      B = stack[-1].send(R)
+      stack.append(gen(B)); R = None
+    except StopIteration as e:
+      stack.pop(); R = e.value
+  return R
+
+def flatten(A): # the distinct subformulas of A as a list of (id, argument positions in the list), A last
+  index = {}
+  fold(A, lambda B,Is: index.setdefault(B,(len(index),(B.id,tuple(Is))))[0], {})
+  return [x[1] for x in index.values()]
+
+def unflatten(L): # inverse of flatten (used for pickling)
+  Bs = []
+  for id,Is in L: Bs.append(fm(id,[Bs[i] for i in Is]))
+  return Bs[-1]
+
+class symbol_base(object): # parser entry for a symbol, shared by all its tokens
+    __slots__ = ("id","lbp","rbp","nulld","leftd")
+    def __init__(self, id, bp):
+        self.id = id
+        self.lbp = bp
+        self.rbp = bp # binding power of the argument of a prefix or infix symbol
+        self.nulld = atom_nulld
 
 def symbol(id, bp=0): # identifier, binding power
     if id in symbol_table:
         s = symbol_table[id]    # look symbol up in table
-        s.lbp = max(bp, s.lbp)  # update left binding power
+        if bp > s.lbp:
+            s.lbp = bp          # update left binding power
+            parse.cache_clear()
     else:
-        class s(symbol_base):   # create class for this symbol
-            pass
-        s.id = id
-        s.lbp = bp
-        s.nulld = lambda self: self
+        global token_re
+        s = symbol_base(id, bp) # create entry for this symbol
         symbol_table[id] = s
+        token_re = None         # rebuild the tokenizer on next use
+        parse.cache_clear()     # strings may now parse differently
     return s
 
-def advance(id=None):
-    global token
-    if id and token.id != id:
-        raise SyntaxError("Expected "+id+" got "+token.id)
-    token = next()
+# The denotations below describe the grammar; parser.expression recognizes them and applies them
+# without recursion (any other denotation is simply called)
+
+def atom_nulld(self, p): # null denotation of variables and constants
+    return fm(self.id,[])
 
-def nulld(self): # null denotation
-    expr = expression()
-    advance(")")
+def nulld(self, p): # null denotation
+    expr = p.expression()
+    p.advance(")")
     return expr
 
+def infix_leftd(self, p, left): # left denotation
+    return fm(self.id,[left,p.expression(self.rbp)])
+
 def infix(id, bp):
-    def leftd(self, left): # left denotation
-        self.a = [left]
-        self.a.append(expression(bp))
-        return self
-    symbol(id, bp).leftd = leftd
+    s = symbol(id, bp)
+    s.leftd = infix_leftd; s.rbp = bp
+
+def prefix_nulld(self, p): # null denotation
+    if p.token.id != "(":
+        return fm(self.id,[p.expression(self.rbp)])
+    else:
+        p.token = p.next()
+        a = []
+        if p.token.id != ")":
+            while 1:
+                a.append(p.expression())
+                if p.token.id != ",":
+                    break
+                p.advance(",")
+        p.advance(")")
+        return fm(self.id,a)
 
 def prefix(id, bp):
-    global token
-    def nulld(self): # null denotation
-        global token
-        if token.id != "(":
-            self.a = [expression(bp)]
-            return self
-        else:
-            token = next()
-            self.a = []
-            if token.id != ")":
-                while 1:
-                    self.a.append(expression())
-                    if token.id != ",":
-                        break
-                    advance(",")
-            advance(")")
-            return self
-    symbol(id, bp).nulld = nulld
+    s = symbol(id, bp)
+    s.nulld = prefix_nulld; s.rbp = bp
+
+def postfix_leftd(self, p, left): # left denotation
+    return fm(self.id,[left])
 
 def postfix(id, bp):
-    def leftd(self,left): # left denotation
-        self.a = [left]
-        return self
-    symbol(id, bp).leftd = leftd
+    symbol(id, bp).leftd = postfix_leftd
+
+token_alias = {"{\\sim}":"\\sim"} # alternative spellings of symbols
+token_re = None # compiled tokenizer, rebuilt after the symbol table changes
+
+def trie_regex(words): # regex that matches the longest word in words, with words sharing prefixes
+  trie = {}
+  for w in words:
+    t = trie
+    for c in w: t = t.setdefault(c,{})
+    t[""] = w
+  def pat(t):
+    alts = [re.escape(c)+pat(t[c]) for c in sorted(t) if c!=""]
+    if "" in t: # a word ends here; a latex command or subscript must not continue
+      w = t[""]
+      alts.append("(?![a-zA-Z])" if re.fullmatch(r"\\[a-zA-Z]+",w) else "(?![0-9])" if w[-1].isdigit() else "")
+    return alts[0] if len(alts)==1 else "(?:"+"|".join(alts)+")"
+  return pat(trie)
+
+def subscript(x, k): # x_k (x_{k} if k has several digits)
+  return x+"_"+(str(k) if k<10 else "{"+str(k)+"}")
+
+INDEXED = r"(\\mathbf [jn])_(?:([0-9])|\{([0-9]+)\})" # nominals \mathbf j_k and co-nominals \mathbf n_k, any k
+
+def tokenize(st): # scan st once with a regex compiled from the symbol table
+    global token_re
+    if token_re is None:
+        token_re = re.compile(r"\s*(?:"+INDEXED+r"|("+trie_regex(list(symbol_table)+list(token_alias))+r")|(\S))")
+    for m in token_re.finditer(st):
+        if m.group(1) is not None: # indexed (co-)nominal, not in the symbol table
+          yield symbol_base(subscript(m.group(1),int(m.group(2) or m.group(3))), 0)
+          continue
+        tok = m.group(4)
+        if tok is None:
+            i = m.start(5)
+            raise SyntaxError("Unknown token "+re.match(r"\\[a-zA-Z]*|.",st[i:]).group()+" at position "+str(i)+" in "+st)
+        yield symbol_table[token_alias.get(tok,tok)]
+    while True: yield symbol_table["(end)"]
+
+class parser(object): # parser state for one input string, so several parses can run at the same time
+    def __init__(self, st):
+        self.next = tokenize(st).__next__
+        self.token = self.next()
+
+    def advance(self, id=None):
+        if id and self.token.id != id:
+            raise SyntaxError("Expected "+id+" got "+self.token.id)
+        self.token = self.next()
+
+    def expression(self, rbp=0): # the denotations of the grammar, applied with an explicit stack
+        stack = [("loop",rbp,None)] # what to do with the next parsed expression
+        while True:
+            t = self.token
+            self.token = self.next()
+            if t.nulld is atom_nulld: left = fm(t.id,[])
+            elif t.nulld is nulld: # (expression)
+                stack += [(")",None,None),("loop",0,None)]
+                continue
+            elif t.nulld is prefix_nulld:
+                if self.token.id != "(":
+                    stack += [("prefix",t.id,None),("loop",t.rbp,None)]
+                    continue
+                self.token = self.next()
+                if self.token.id == ")":
+                    self.token = self.next()
+                    left = fm(t.id,[])
+                else:
+                    stack += [("args",t.id,[]),("loop",0,None)]
+                    continue
+            else: left = t.nulld(t, self)
+            while True: # pass left to the enclosing expressions until one needs another argument
+                k, x, a = stack[-1]
+                if k == "loop": # left denotations while they bind tighter than x
+                    if x < self.token.lbp:
+                        t = self.token
+                        self.token = self.next()
+                        if t.leftd is infix_leftd:
+                            stack += [("infix",t.id,left),("loop",t.rbp,None)]
+                            break
+                        if t.leftd is postfix_leftd: left = fm(t.id,[left])
+                        else: left = t.leftd(t, self, left)
+                        continue
+                    stack.pop()
+                    if stack == []: return left
+                elif k == ")":
+                    stack.pop()
+                    self.advance(")")
+                elif k == "prefix":
+                    stack.pop()
+                    left = fm(x,[left])
+                elif k == "infix":
+                    stack.pop()
+                    left = fm(x,[a,left])
+                else: # "args" of prefix(arg,...,arg)
+                    a.append(left)
+                    if self.token.id == ",":
+                        self.advance(",")
+                        stack.append(("loop",0,None))
+                        break
+                    stack.pop()
+                    self.advance(")")
+                    left = fm(x,a)
+
+@lru_cache(maxsize=4096)
+def parse(str): # e.g., t = parse(r"(p\circ q)\lor \mathbf t"); formulas are immutable, so results are cached
+    p = parser(str)
+    A = p.expression()
+    if p.token.id != "(end)":
+        raise SyntaxError("Unexpected "+p.token.id+" in "+str)
+    return A
+
+def end_nulld(self, p):
+    raise SyntaxError("Unexpected end of input")
 
 symbol("(").nulld = nulld
 symbol(")")
 symbol("[").nulld = nulld
 symbol("]")
-symbol("(end)")
+symbol("(end)").nulld = end_nulld
 
 for st in ATOMS|FVAR|FOVAR|CONST: symbol(st)
 for st in NEG+FOPRE: prefix(st,9)
@@ -129,83 +329,102 @@ for st in FOVAR: prefix(All+" "+st,7)
 for st in FOVAR: prefix(Exists+" "+st,7)
 for t in POSPOS+NEGPOS+POSNEG+FOINFIX: infix(t[0],t[1])
 
-def tokenize(st):
-    i = 0
-    while i<len(st):
-        tok = st[i] #read single-letter token
-        j = i+1
-        if j<len(st) and st[j]=="_": #read subscript
-          j+=1
-          if st[j]=="{": j+=1
-          while j<len(st) and st[j]>='0' and st[j]<='9': j+=1
-          if j<len(st) and st[j]=="}": j+=1
-          tok = st[i:j]
-        elif tok=="{":
-            tok = st[j]
-            j+=1
-        if tok=="\\": #read Latex symbol
-            while j<len(st) and ((st[j]>='a' and st[j]<='z') or\
-                (st[j]>='A' and st[j]<='Z')): j+=1
-            if j<len(st) and st[j]=='^': #read \sim^\sharp, \sim^\flat
-                j+=1
-                if st[j]=='\\':
-                    j+=1
-                    while j<len(st) and ((st[j]>='a' and st[j]<='z') or\
-                        (st[j]>='A' and st[j]<='Z')): j+=1
-            if st[i]=="{" and st[j]=="}": j+=1
-            tok = st[i:j]
-            if tok in ["\\mathbf","\\forall","\\exists"]:
-              j+=2
-              if j<len(st) and st[j]=="_": #read subscript
-                j+=1
-                if st[j]=="{": j+=1
-                while j<len(st) and st[j]>='0' and st[j]<='9': j+=1
-                if j<len(st) and st[j]=="}": j+=1
-              tok = st[i:j]
-        i = j
-        if tok!=' ':
-            symb = symbol_table[tok]
-            if not symb: raise SyntaxError("Unknown operator")
-            yield symb()
-    symb = symbol_table["(end)"]
-    yield symb()
-
-def expression(rbp=0):
-    global token
-    t = token
-    token = next()
-    left = t.nulld()
-    while rbp < token.lbp:
-        t = token
-        token = next()
-        left = t.leftd(left)
-    return left
-
-def parse(str): # e.g., t = parse(r"(p\circ q)\lor \mathbf t")
-    global token, next
-    next = tokenize(str.replace("{\\sim}","\\sim ")).__next__
-    token = next()
-    return expression()
-
-output_list=[]
+### Run-time state ##############################################
+
+class PearlContext(object): # run-time state of purify/pearl, so independent runs do not share anything
+  # each call of purify/pearl runs in a new context (see in_new_context), and other functions use the one
+  # of the running thread or task (see context); "with PearlContext():" runs a block in a new context
+  __slots__ = ("freshNOM","freshCNOM","split_limit","split_budget","splits","split_nodes","output_list","stats","token")
+  def __init__(self):
+    self.freshNOM = 0; self.freshCNOM = 0 # fresh nominal and co-nominal counters
+    self.split_limit = None  # maximum number of inclusions that splitting may produce for one formula (None = no limit)
+    self.split_budget = None # maximum total number of formula nodes in these inclusions (None = no limit)
+    self.splits = 0; self.split_nodes = 0 # inclusions (and their nodes) produced by splitting so far
+    self.output_list = [] # LaTeX strings of the steps of the current purify/pearl call (only if info is set)
+    self.stats = None     # counters of the current purify/pearl call (only if profile is set, see new_stats)
+    self.token = None
+  def reset(self, split_limit=None, split_budget=None): # start counting fresh (co-)nominals and inclusions
+    # produced by splitting at 0 again, with these limits for the next formula
+    self.freshNOM = 0; self.freshCNOM = 0
+    self.split_limit = split_limit; self.split_budget = split_budget
+    self.splits = 0; self.split_nodes = 0
+  def __enter__(self):
+    self.token = current_context.set(self)
+    return self
+  def __exit__(self, *exc):
+    current_context.reset(self.token)
+    self.token = None
+
+current_context = contextvars.ContextVar("pearl_context")
+
+def context(): # the PearlContext of the running thread or task
+  c = current_context.get(None)
+  if c is None:
+    c = PearlContext()
+    current_context.set(c)
+  return c
+
+def in_new_context(f): # run each call of f in a new PearlContext; threads started with a copy of the
+  # caller's contextvars (asyncio.to_thread, copy_context().run) would otherwise share the caller's one
+  @wraps(f)
+  def g(*args, **kw):
+    with PearlContext(): return f(*args, **kw)
+  return g
+
+class Nominals(object): # the (co-)nominals of the signature and the indexed ones, recognized by their name
+  def __init__(self, base, prefix):
+    self.base = base     # set of nominals of the signature
+    self.prefix = prefix # indexed ones are prefix+k or prefix+{k} for any k (see subscript)
+  def __contains__(self, x):
+    return x in self.base or x.startswith(self.prefix)
+  def __iter__(self): # only those of the signature, there are infinitely many indexed ones
+    return iter(self.base)
+  def __len__(self):
+    return len(self.base)
+
+NOM0 = frozenset(NOM); CNOM0 = frozenset(CNOM) # initial nominals and co-nominals
+NOM = Nominals(NOM0,"\\mathbf j_"); CNOM = Nominals(CNOM0,"\\mathbf n_")
+
+def new_stats(): # time per stage (seconds), new formula nodes, split points, approximation rules applied,
+  # fresh nominals/co-nominals, inclusions removed by subsume, Ackermann attempts and failures per variable,
+  # rewrites by reduce
+  return {"time":{}, "fm":0, "split":0, "appr_left":0, "appr_right":0, "NOM":0, "CNOM":0, "subsumed":0,
+          "Ackermann":{}, "rewrite":0}
+
+def stage(name, f, *args): # run one stage of purify/pearl, timing it if profiling is on
+  S = context().stats
+  if S is None: return f(*args)
+  t = time.perf_counter()
+  try: return f(*args)
+  finally: S["time"][name] = S["time"].get(name,0)+time.perf_counter()-t
+
+def report(profile): # hand the counters of the finished call to profile (a dict to update or a callback)
+  c = context()
+  S, c.stats = c.stats, None
+  if callable(profile): profile(S)
+  else: profile.update(S)
+
+def display_math(st): # typeset st in a notebook; IPython is only imported when something is displayed
+  from IPython.display import display, Math
+  display(Math(Macros+st))
 
 def showq(A, info=True): # display a quasi-inclusion
-  global output_list
+  if not info: return # no LaTeX is produced without output
   if type(A)==str: st = A
   else: st = ",\\ ".join([repr(x) for x in A[:-1]])+\
              ("\\quad"+Imp+"\\quad " if len(A)>1 else "")+repr(A[-1])
   st = st.replace("\\sim","{\\sim}")
-  output_list.append(st)
+  context().output_list.append(st)
   if info==True:
-    display(Math(Macros+st))
+    display_math(st)
 
 def show(A, info=True): # display a (list of) formula(s)
-  global output_list
+  if not info: return
   st = A if type(A)==str else repr(A)
   st = st.replace("\\sim","{\\sim}")
-  output_list.append(st)
+  context().output_list.append(st)
   if info==True:
-    display(Math(Macros+st))
+    display_math(st)
 
 ############### end of parser code ##################
 
@@ -213,80 +432,99 @@ def show(A, info=True): # display a (list of) formula(s)
 #Check if all occurances of a variable p in a formula A are positive/negative
 
 def all_positive(A,p):
-  if A.a==[]: return True
-  if A.id in NEG: return all_negative(A.a[0],p)
-  if A.id in PP0:
-    return all_positive(A.a[0],p) and all_positive(A.a[1],p)
-  if A.id in NP0:
-    return all_negative(A.a[0],p) and all_positive(A.a[1],p)
-  return "Error" # should not get here
+  return all_signed(A,p,True)
 
 def all_negative(A,p):
-  if A.id==p: return False
-  if A.id in NEG: return all_positive(A.a[0],p)
-  if A.id in PP0:
-    return all_negative(A.a[0],p) and all_negative(A.a[1],p)
-  if A.id in NP0:
-    return all_positive(A.a[0],p) and all_negative(A.a[1],p)
-  return True  # all other variables or constants
+  return all_signed(A,p,False)
+
+def all_signed(A,p,pol): # check that p has no occurrence of the opposite polarity in A (signed pol)
+  # subformulas with other operations are not searched
+  stack = [(A,pol)]
+  while stack:
+    B,pol = stack.pop()
+    if B.id==p:
+      if not pol: return False
+    elif B.id in NEG: stack.append((B.a[0],not pol))
+    elif B.id in PP0: stack += [(B.a[0],pol),(B.a[1],pol)]
+    elif B.id in NP0: stack += [(B.a[0],not pol),(B.a[1],pol)]
+  return True
 
 def Var(A,typ=VARFVAR): # return set of all variables that occur in formula or list of formulas A
   V = set([])
-  if type(A)==list:
-    for B in A: V |= Var(B,typ)
-    return V
-  if A.id in typ:
-    V.add(A.id)
-  for B in A.a: V |= Var(B,typ)
+  stack = list(A) if type(A)==list else [A]
+  seen = set()
+  while stack:
+    B = stack.pop()
+    if B in seen: continue
+    seen.add(B)
+    if B.id in typ: V.add(B.id)
+    stack += B.a
   return V
 
-def fm(id, arg): # build formula from identifier and argument formulas
-  class s(symbol_base):   # create class for this symbol
-    pass
-  s.id = id
-  s.lbp = symbol_table[id].lbp if id in symbol_table.keys() else 0
-  s.a = arg
-  for A in arg:
-    A.lbp = symbol_table[A.id].lbp if A.id in symbol_table.keys() else 0
-  return s()
-
-def copy_expr(A):
-  if A.a==[]: return A
-  else: return fm(A.id,[copy_expr(x) for x in A.a])
-
-def find_split(A,P,positive): # P is the parent of A, needed to modify formula later
+def find_split(A,positive):
   #find a neg join or pos meet in A, not in scope of neg -> or pos circ
-  #return parent of this subterm
-  if A.a==[]: return None
-  if A.id==Invol: return find_split(A.a[0], A, not positive)
-  if A.id==Join and not positive or A.id==Meet and positive: return (A,P)
-  if A.id==Mult:
-    if not positive:
-      B = find_split(A.a[0], A, positive)
-      if B!=None: return B
-      return find_split(A.a[1], A, positive)
-    else: return None
-  if A.id in [Rimp,Le]:
-    if positive:
-      B = find_split(A.a[0], A, not positive)
-      if B!=None: return B
-      return find_split(A.a[1], A, positive)
-    else: return None
+  #return the path (tuple of argument positions) to the first such subterm (leftmost, outermost)
+  path = [] # argument positions leading to the subterm that is searched
+  stack = [(A,positive,0,None)] # (subterm, sign, depth, argument position)
+  while stack:
+    A,positive,d,i = stack.pop()
+    if d>0:
+      del path[d-1:]
+      path.append(i)
+    if A.a==(): continue
+    if A.id==Invol: stack.append((A.a[0],not positive,d+1,0))
+    elif A.id==Join and not positive or A.id==Meet and positive: return tuple(path)
+    elif A.id==Mult:
+      if not positive: stack += [(A.a[1],positive,d+1,1),(A.a[0],positive,d+1,0)]
+    elif A.id in [Rimp,Le]:
+      if positive: stack += [(A.a[1],positive,d+1,1),(A.a[0],not positive,d+1,0)]
+  return None
+
+def subterm(A,path): # return the subterm of A at path
+  for i in path: A = A.a[i]
+  return A
+
+def put(A,path,B): # return a copy of A with the subterm at path replaced by B (other subterms are shared)
+  As = []
+  for i in path:
+    As.append(A)
+    A = A.a[i]
+  for A,i in zip(reversed(As),reversed(path)):
+    B = fm(A.id,A.a[:i]+(B,)+A.a[i+1:])
+  return B
+
+class TooLarge(Exception): # raised when splitting exceeds the split_limit or split_budget of the context
+  pass
+
+def isplit(A): # generate the inclusions of split(A) one at a time, in the same order
+  # the inclusions share all subterms that are not on the path to a split point; those made by splitting
+  # count towards the split_limit and split_budget of the current formula (all splits of preprocess and
+  # approximate together, see PearlContext), and TooLarge is raised as soon as one would be exceeded
+  c = context()
+  stack = [A]
+  while stack!=[]:
+    B = stack.pop()
+    P = find_split(B,True)
+    if P==None:
+      if B is not A:
+        c.splits += 1; c.split_nodes += B.n
+        if c.split_limit!=None and c.splits>c.split_limit:
+          raise TooLarge("too large: splitting gives more than "+str(c.split_limit)+" inclusions")
+        if c.split_budget!=None and c.split_nodes>c.split_budget:
+          raise TooLarge("too large: splitting gives more than "+str(c.split_budget)+" formula nodes")
+      yield B
+    else:
+      S = context().stats
+      if S is not None: S["split"] += 1
+      C = subterm(B,P)
+      stack.append(put(B,P,C.a[1]))
+      stack.append(put(B,P,C.a[0]))
 
 def split(A): # A is a single *inclusion* formula
-  C = find_split(A,None,True)
-  if C==None: return [A]
-  B = copy_expr(A)
-  D = find_split(B,None,True)
-  if C[0] is C[1].a[0]: C[1].a[0] = C[0].a[0] 
-  else: C[1].a[1] = C[0].a[0]
-  if D[0] is D[1].a[0]: D[1].a[0] = D[0].a[1] 
-  else: D[1].a[1] = D[0].a[1]
-  return split(A) + split(B)
+  return list(isplit(A))
 
 def replace(A,p,B): # in formula A replace variable p by formula B
-  if A.id==p: return B
-  return fm(A.id,[replace(C,p,B) for C in A.a])
+  return fold(A, lambda C,Cs: B if C.id==p else C if Cs==list(C.a) else fm(C.id,Cs))
 
 def mono_var_elim(A): # Apply monotone variable elimination rule to an inclusion
   # find all variables in A and eliminate the ones that qualify
@@ -300,52 +538,67 @@ def mono_var_elim(A): # Apply monotone variable elimination rule to an inclusion
         A = replace(A,p,parse("\\top"))
     return A
 
-def equal(A,B): # Check if two formulas are syntactically identical
-  if A.id!=B.id: return False
-  if A.a==B.a: return True
-  if len(A.a)!=len(B.a): return False
-  return all(equal(A.a[i],B.a[i]) for i in range(len(A.a)))
+def equal(A,B): # Check if two formulas are syntactically identical (hash-consed, so identical objects)
+  return A is B
 
-def reduceTF(A): # Apply some valid rewrite rules repeatedly for any subformula B
+def rewrite(A): # Apply one of some valid rewrite rules at the root of A, or return None
   # B\circ\bot, \bot\circ B ==> \bot
   # \bot\to B, B\to\top ==> \top
   # B\land B, B\lor B ==> B
-  if A.a==[]: return (A,False)
-  if A.id==Mult and (A.a[0].id==Bot or A.a[1].id==Bot): return (fm(Bot,[]),True)
-  if A.id==Mult and A.a[0].id==Iden: return (A.a[1],True)
-  if A.id==Rimp and (A.a[0].id==Bot or A.a[1].id==Top): return (fm(Top,[]),True)
-  if A.id==Meet and (A.a[0].id==Bot or A.a[1].id==Bot): return (fm(Bot,[]),True)
-  if A.id==Meet and A.a[0].id==Top: return (A.a[1],True)
-  if A.id==Meet and A.a[1].id==Top: return (A.a[0],True)
-  if A.id in (Meet,Join) and equal(A.a[0],A.a[1]): return (A.a[0],True)
-  if A.id==Join and (A.a[0].id==Top or A.a[1].id==Top): return (fm(Top,[]),True)  
-  if A.id==Join and A.a[0].id==Bot: return (A.a[1],True)
-  if A.id==Join and A.a[1].id==Bot: return (A.a[0],True)
-  if A.id==Invol and A.a[0].id==Bot: return (fm(Top,[]),True)
-  if A.id==Invol and A.a[0].id==Top: return (fm(Bot,[]),True)
-  if A.id==Le and A.a[0].id==Bot: return (fm(TRUE,[]),True)
-  if A.id==Le and A.a[0].id==Top and (A.a[1].id in CNOM or A.a[1].id==Bot): return (fm(FALSE,[]),True)
-  if A.id==Le and A.a[1].id==Top: return (fm(TRUE,[]),True)
-  if A.id==Le and A.a[1].id==Bot and A.a[0].id in NOM: return (fm(FALSE,[]),True)
-  if A.id==Le and equal(A.a[0],A.a[1]): return (fm(TRUE,[]),True)
-  if A.id==And and (A.a[0].id==FALSE or A.a[1].id==FALSE): return (fm(FALSE,[]),True)
-  if A.id==And and A.a[0].id==TRUE: return (A.a[1],True)
-  if A.id==And and A.a[1].id==TRUE: return (A.a[0],True)
-  if A.id in (And,Or) and equal(A.a[0],A.a[1]): return (A.a[0],True)
-  if A.id==Or and (A.a[0].id==TRUE or A.a[1].id==TRUE): return (fm(TRUE,[]),True)  
-  if A.id==Or and A.a[0].id==FALSE: return (A.a[1],True)
-  if A.id==Or and A.a[1].id==FALSE: return (A.a[0],True)
-  if A.id==Imp and equal(A.a[0],A.a[1]): return (fm(TRUE,[]),True)
-  Bs = [reduceTF(B) for B in A.a]
-  Cs = [B[0] for B in Bs]
-  if any(B[1] for B in Bs): return reduceTF(fm(A.id,Cs))
-  return (fm(A.id,Cs),False)
+  # the result is always an argument of A or a constant
+  if A.id==Mult and (A.a[0].id==Bot or A.a[1].id==Bot): return fm(Bot,[])
+  if A.id==Mult and A.a[0].id==Iden: return A.a[1]
+  if A.id==Rimp and (A.a[0].id==Bot or A.a[1].id==Top): return fm(Top,[])
+  if A.id==Meet and (A.a[0].id==Bot or A.a[1].id==Bot): return fm(Bot,[])
+  if A.id==Meet and A.a[0].id==Top: return A.a[1]
+  if A.id==Meet and A.a[1].id==Top: return A.a[0]
+  if A.id in (Meet,Join) and equal(A.a[0],A.a[1]): return A.a[0]
+  if A.id==Join and (A.a[0].id==Top or A.a[1].id==Top): return fm(Top,[])  
+  if A.id==Join and A.a[0].id==Bot: return A.a[1]
+  if A.id==Join and A.a[1].id==Bot: return A.a[0]
+  if A.id==Invol and A.a[0].id==Bot: return fm(Top,[])
+  if A.id==Invol and A.a[0].id==Top: return fm(Bot,[])
+  if A.id==Le and A.a[0].id==Bot: return fm(TRUE,[])
+  if A.id==Le and A.a[0].id==Top and (A.a[1].id in CNOM or A.a[1].id==Bot): return fm(FALSE,[])
+  if A.id==Le and A.a[1].id==Top: return fm(TRUE,[])
+  if A.id==Le and A.a[1].id==Bot and A.a[0].id in NOM: return fm(FALSE,[])
+  if A.id==Le and equal(A.a[0],A.a[1]): return fm(TRUE,[])
+  if A.id==And and (A.a[0].id==FALSE or A.a[1].id==FALSE): return fm(FALSE,[])
+  if A.id==And and A.a[0].id==TRUE: return A.a[1]
+  if A.id==And and A.a[1].id==TRUE: return A.a[0]
+  if A.id in (And,Or) and equal(A.a[0],A.a[1]): return A.a[0]
+  if A.id==Or and (A.a[0].id==TRUE or A.a[1].id==TRUE): return fm(TRUE,[])  
+  if A.id==Or and A.a[0].id==FALSE: return A.a[1]
+  if A.id==Or and A.a[1].id==FALSE: return A.a[0]
+  if A.id==Imp and equal(A.a[0],A.a[1]): return fm(TRUE,[])
+  return None
+
+def normalize(A, memo=None): # Simplify each subformula of A once, bottom-up, after its arguments
+  # return (simplified formula, number of rewrites applied); shared subformulas are simplified once
+  # (fold with the rewrite step written out, since this is the most frequent traversal)
+  if memo is None: memo = {}
+  n = 0
+  stack = [A]
+  while stack:
+    B = stack.pop()
+    if B in memo: continue
+    if B.a==(): memo[B] = B; continue
+    Cs = [memo.get(C,memo) for C in B.a]
+    if memo in Cs:
+      stack.append(B); stack += B.a
+      continue
+    C = B if Cs==list(B.a) else fm(B.id,Cs)
+    D = rewrite(C)
+    if D is None: memo[B] = C
+    else: memo[B] = D; n += 1
+  return (memo[A],n)
 
 def reduce(A):
   if type(A)==str: return A
-  B = reduceTF(A)
-  if B[1]: return reduce(B[0])
-  return B[0]
+  B,n = normalize(A)
+  S = context().stats
+  if S is not None: S["rewrite"] += n
+  return B
 
 def first_appr(A,nom="i",cnom="m"):
   if A.id==Le:
@@ -353,22 +606,25 @@ def first_appr(A,nom="i",cnom="m"):
             fm(A.id,[A.a[1],parse("\\mathbf "+cnom)]),
             fm(A.id,[parse("\\mathbf "+nom),parse("\\mathbf "+cnom)])]
 
-freshNOM = 0; freshCNOM = 0
-def get_NOM():
-  global freshNOM
-  freshNOM += 1
-  nam = "\\mathbf j_"+(str(freshNOM) if freshNOM<10 else "{"+str(freshNOM)+"}")
-  NOM.add(nam)
-  symbol(nam)
-  return parse(nam)
-
-def get_CNOM():
-  global freshCNOM
-  freshCNOM += 1
-  nam = "\\mathbf n_"+(str(freshCNOM) if freshCNOM<10 else "{"+str(freshCNOM)+"}")
-  CNOM.add(nam)
-  symbol(nam)
-  return parse(nam)
+@lru_cache(maxsize=4096)
+def nominal(k): # the nominal \mathbf j_k (k >= 0)
+  return fm(subscript("\\mathbf j",k),[])
+
+@lru_cache(maxsize=4096)
+def conominal(k): # the co-nominal \mathbf n_k (k >= 0)
+  return fm(subscript("\\mathbf n",k),[])
+
+def get_NOM(): # fresh nominal of the current context
+  c = context()
+  c.freshNOM += 1
+  if c.stats is not None: c.stats["NOM"] += 1
+  return nominal(c.freshNOM)
+
+def get_CNOM(): # fresh co-nominal of the current context
+  c = context()
+  c.freshCNOM += 1
+  if c.stats is not None: c.stats["CNOM"] += 1
+  return conominal(c.freshCNOM)
 
 def appr_left(A):
   if A.id==Le:
@@ -397,64 +653,118 @@ def appr_right(A):
   return [A]
 
 def appr_all(As): #appr_left and appr_right until stable
-  Bs = As[:] # (shallow) copy list
-  while True:
-    n = len(Bs)
-    Cs = []
-    for A in Bs: Cs += appr_left(A)
-    Bs = []
-    for A in Cs: Bs += appr_right(A)
-    if n==len(Bs): break
+  # each round applies appr_left and then appr_right only to the inclusions created in the previous round;
+  # inclusions are kept in a tree (item = [inclusion, items it was replaced by]) so the result has the
+  # same order, and fresh nominals the same numbers, as rounds over the whole list
+  items = [[A,None] for A in As]
+  work = items
+  while work!=[]:
+    Ls = [appr_left(x[0]) for x in work]
+    new = []
+    for x,L in zip(work,Ls):
+      Rs = [B for A in L for B in appr_right(A)]
+      S = context().stats
+      if S is not None:
+        S["appr_left"] += len(L)>1
+        S["appr_right"] += len(Rs)-len(L)
+      if len(Rs)>1:
+        x[1] = [[B,None] for B in Rs]
+        new += x[1]
+    work = new
+  Bs = []
+  stack = items[::-1]
+  while stack!=[]:
+    x = stack.pop()
+    if x[1]==None: Bs.append(x[0])
+    else: stack += x[1][::-1]
   return Bs
 
 def signedVars(A, pol): #return list of (var,+/-) of inclusion formula A
-  if A.a==[] and A.id in VARFVAR: return [(A.id,pol)]
-  if A.id in NEG: return signedVars(A.a[0],not pol)
-  if A.id in PP0: return signedVars(A.a[0],pol) + signedVars(A.a[1],pol)
-  if A.id in NP0: return signedVars(A.a[0],not pol) + signedVars(A.a[1],pol)
-  if A.id in PN0: return signedVars(A.a[0],pol) + signedVars(A.a[1],not pol)
-  return []
+  V = []
+  stack = [(A,pol)]
+  while stack:
+    A,pol = stack.pop()
+    if A.a==() and A.id in VARFVAR: V.append((A.id,pol))
+    elif A.id in NEG: stack.append((A.a[0],not pol))
+    elif A.id in PP0: stack += [(A.a[1],pol),(A.a[0],pol)]
+    elif A.id in NP0: stack += [(A.a[1],pol),(A.a[0],not pol)]
+    elif A.id in PN0: stack += [(A.a[1],not pol),(A.a[0],pol)]
+  return V
 
 def exposepos(A,p):
   #print("exposepos",A,p)
-  if A.a[1].id==p: return A.a[0]
-  if A.a[0].id==Invol:  # ~00 <= 1
-    return exposepos(fm(Le,[fm(Dualgc,[A.a[1]]),A.a[0].a[0]]),p)
-  if A.a[1].id==Join: # 0 <= 10 v 11
-    B = exposepos(fm(Le,[fm(Coimp,[A.a[0],A.a[1].a[1]]),A.a[1].a[0]]),p)
-    if type(B)!=str: return B
-    return exposepos(fm(Le,[fm(Coimp,[A.a[0],A.a[1].a[0]]),A.a[1].a[1]]),p)
-  if A.a[1].id==Rimp: # 0 <= 10 -> 11
-    return exposepos(fm(Le,[fm(Mult,[A.a[0],A.a[1].a[0]]),A.a[1].a[1]]),p)
+  stack = [A] # inclusions still to be tried, the next one last
+  while stack:
+    A = stack.pop()
+    if A.a[1].id==p: return A.a[0]
+    if A.a[0].id==Invol:  # ~00 <= 1
+      stack.append(fm(Le,[fm(Dualgc,[A.a[1]]),A.a[0].a[0]]))
+    elif A.a[1].id==Join: # 0 <= 10 v 11
+      stack += [fm(Le,[fm(Coimp,[A.a[0],A.a[1].a[0]]),A.a[1].a[1]]),
+                fm(Le,[fm(Coimp,[A.a[0],A.a[1].a[1]]),A.a[1].a[0]])]
+    elif A.a[1].id==Rimp: # 0 <= 10 -> 11
+      stack.append(fm(Le,[fm(Mult,[A.a[0],A.a[1].a[0]]),A.a[1].a[1]]))
   return "+"+p+" is not exposeable"
 
 def exposeneg(A,p):
   #print("exposeneg",A,p)
-  if A.a[0].id==p: return A.a[1]
-  if A.a[1].id==Invol:  # 0 <= ~10
-    return exposeneg(fm(Le,[A.a[1].a[0],fm(Galcon,[A.a[0]])]),p)
-  if A.a[0].id==Meet: # 00 ^ 01 <= 1
-    B = exposeneg(fm(Le,[A.a[0].a[0],fm(Himp,[A.a[0].a[1],A.a[1]])]),p)
-    if type(B)!=str: return B
-    return exposeneg(fm(Le,[A.a[0].a[1],fm(Himp,[A.a[0].a[0],A.a[1]])]),p)
-  if A.a[0].id==Mult: # 00 o 01 <= 1
-    return exposeneg(fm(Le,[A.a[0].a[0],fm(Rimp,[A.a[0].a[1],A.a[1]])]),p)
-  if A.a[1].id==Rimp: # 0 <= 10 -> 11
-    return exposeneg(fm(Le,[fm(Mult,[A.a[0],A.a[1].a[0]]),A.a[1].a[1]]),p)
+  stack = [A] # inclusions still to be tried, the next one last
+  while stack:
+    A = stack.pop()
+    if A.a[0].id==p: return A.a[1]
+    if A.a[1].id==Invol:  # 0 <= ~10
+      stack.append(fm(Le,[A.a[1].a[0],fm(Galcon,[A.a[0]])]))
+    elif A.a[0].id==Meet: # 00 ^ 01 <= 1
+      stack += [fm(Le,[A.a[0].a[1],fm(Himp,[A.a[0].a[0],A.a[1]])]),
+                fm(Le,[A.a[0].a[0],fm(Himp,[A.a[0].a[1],A.a[1]])])]
+    # the next two rules undo each other, so each is only used if it moves p towards the left side
+    elif A.a[0].id==Mult and p in Var(A.a[0].a[0]): # 00 o 01 <= 1
+      stack.append(fm(Le,[A.a[0].a[0],fm(Rimp,[A.a[0].a[1],A.a[1]])]))
+    elif A.a[1].id==Rimp and p in Var(A.a[1]): # 0 <= 10 -> 11
+      stack.append(fm(Le,[fm(Mult,[A.a[0],A.a[1].a[0]]),A.a[1].a[1]]))
   return "-"+p+" is not exposeable"
 
+occ_index = WeakKeyDictionary() # formula -> occurrence index, kept alongside each (hash-consed) formula
+
+def signed_occ(A, pol, path, occ): # add (path,polarity) of each variable occurrence in A to occ[var]
+  # visits the same occurrences as signedVars
+  stack = [(A,pol,path)]
+  while stack:
+    A,pol,path = stack.pop()
+    if A.a==() and A.id in VARFVAR: occ.setdefault(A.id,[]).append((path,pol))
+    elif A.id in NEG: stack.append((A.a[0],not pol,path+(0,)))
+    elif A.id in PP0: stack += [(A.a[1],pol,path+(1,)),(A.a[0],pol,path+(0,))]
+    elif A.id in NP0: stack += [(A.a[1],pol,path+(1,)),(A.a[0],not pol,path+(0,))]
+    elif A.id in PN0: stack += [(A.a[1],not pol,path+(1,)),(A.a[0],pol,path+(0,))]
+
+def occ_table(occ): # var -> (positive count, negative count, sorted tuple of (path,polarity))
+  return {v:(sum(1 for x in P if x[1]),sum(1 for x in P if not x[1]),tuple(sorted(P))) for v,P in occ.items()}
+
+def occurrences(A): # occurrence index of formula A (computed once, then looked up)
+  I = occ_index.get(A)
+  if I is None:
+    occ = {}
+    signed_occ(A,True,(),occ)
+    I = occ_index[A] = occ_table(occ)
+  return I
+
+def substituted_occurrences(I,p,J): # occurrence index of A with p replaced by C, from the indexes I of A and J of C
+  occ = {v:list(P[2]) for v,P in I.items() if v!=p}
+  for path,pol in I[p][2]:
+    for v,Q in J.items():
+      occ.setdefault(v,[]).extend((path+x[0],pol==x[1]) for x in Q[2])
+  return occ_table(occ)
+
 def expose(A,p,pol): # A is a single inclusion formula
   # return B s.t. B<=p if pol, else p<=B, or "(pol)p not exposable" or bool 
   # bool is returned if (pol)p is not exposable, True if p occurs in B, False otherwise
-  V = signedVars(A,True) # list of signed variables occuring in A
-  c = V.count((p,pol))
+  I = occurrences(A).get(p) # (positive count, negative count, paths) of p in A
+  if I==None: return False  #no occurance of p in A
+  c = I[0] if pol else I[1]
   #print(A,p,pol,c)
   if c>1: return p+" occurs repeatedly with polarity "+str(pol)
-  Vs = set(V)
-  if c==0:
-    if (p,not pol) not in Vs: return False  #no occurance of p in A
-    else: return True
-  if (p,not pol) in Vs: return p+" occurs + and - in formula!" # Condition 1 fails; not inductive
+  if c==0: return True
+  if I[1 if pol else 0]>0: return p+" occurs + and - in formula!" # Condition 1 fails; not inductive
   # so p occurs once in A with correct polarity; find it and try to expose it
   return exposepos(A,p) if pol else exposeneg(A,p) # look for p, return other side of exposed inclusion, or error string
 
@@ -462,26 +772,43 @@ def Ackermann(As,p,pol): #As is a quasiequation, p a var, pol a polarity (bool)
   # find all inclusions with exposable variable (pol)p, collect displayed term in expo
   # check p has opposite pol in all other inclusions, collect them in nexpo
   # form disjunction if pol, else conjunction, of all displayed terms and replace p in all nexpo
+  S = context().stats
+  if S is not None: S["Ackermann"].setdefault(p,[0,0])[0] += 1 # [attempts, failures]
   expo = []
   nexpo = []
   for A in As:
     B = expose(A,p,pol)
     #print(p,pol)
     #show(A);show(B)
-    if type(B)==str: return B
+    if type(B)==str:
+      if S is not None: S["Ackermann"][p][1] += 1
+      return B
     if type(B)==bool: nexpo.append((A,B)) #B True if p occurs in A, False otherwise
     else: expo.append(B)
-  if expo==[]: return ("+" if pol else "-")+p+" has no exposable occurence"  # Condition 3 fails
+  if expo==[]:
+    if S is not None: S["Ackermann"][p][1] += 1
+    return ("+" if pol else "-")+p+" has no exposable occurence"  # Condition 3 fails
   C = expo[0]
   for D in expo[1:]: C = fm(Join if pol else Meet,[C,D])
-  Bs = [replace(x[0],p,C) if x[1] else x[0] for x in nexpo]
+  J = occurrences(C)
+  Bs = []
+  for A,occurs in nexpo:
+    if occurs:
+      B = replace(A,p,C)
+      if B not in occ_index: occ_index[B] = substituted_occurrences(occurrences(A),p,J) # update, don't recompute
+      A = B
+    Bs.append(A)
   return Bs
 
-def elim(As,vars,ps,info): #As is a quasiequation of inclusions, try eliminating each p in vars
+def elim(As,vars,ps,info,search=False): #As is a quasiequation of inclusions, try eliminating each p in vars
+  # variables are tried in sorted order, so the result does not depend on set iteration order
+  # search="first" backtracks over variable orders and polarities until an elimination succeeds,
+  # search="best" returns the successful elimination with the smallest output (see elim_search)
+  if search: return elim_search(As,vars,info,search)
   if vars == set([]): 
     if info: show(ps,info)
     return As
-  for p in vars:
+  for p in sorted(vars):
     Bs = Ackermann(As,p,True)
     if type(Bs)!=str: return elim(Bs,vars-{p},ps+["+"+p],info)
     #print(Bs)
@@ -492,14 +819,48 @@ def elim(As,vars,ps,info): #As is a quasiequation of inclusions, try eliminating
     if Bs[-1]=="!": return Bs
   return "not inductive; no variable order and no polarity choices succeed!"
 
+def elim_cost(As): # results without leftover variables first, then smaller results
+  return (len(Var(As)),sum(B.n for B in As))
+
+def elim_search(As,vars,info,search="first"): # explore variable orders and polarity choices
+  # states (set of inclusions, remaining variables) are memoized, so each is explored once
+  # and branches that reach a state known to fail are pruned
+  memo = {}
+  def explore(As,vars): # return (inclusions, eliminated signed vars) or a string if no choice succeeds
+    key = (frozenset(As),frozenset(vars))
+    if key in memo: return memo[key]
+    if vars == set([]): return (As,[])
+    best = None
+    for p in sorted(vars):
+      for pol in (True,False):
+        Bs = Ackermann(As,p,pol)
+        if type(Bs)==str:
+          if Bs[-1]=="!": # p can never be eliminated from this state
+            memo[key] = Bs
+            return Bs
+          continue
+        R = explore(Bs,vars-{p})
+        if type(R)==str: continue
+        R = (R[0],[("+" if pol else "-")+p]+R[1])
+        if search!="best":
+          memo[key] = R
+          return R
+        if best==None or elim_cost(R[0])<elim_cost(best[0]): best = R
+    memo[key] = best if best!=None else "not inductive; no variable order and no polarity choices succeed!"
+    return memo[key]
+  R = explore(As,vars)
+  if type(R)==str: return R
+  if info: show(R[1],info)
+  return R[0]
+
 def simpl_left(As): # As is a quasiequation
   A = As[-1]
-  if A.a==[]: return As
+  if A.a==(): return As
   B = A.a[0]
   if B.id in NOM and B.id not in Var(A.a[1],NOM):
     found = -1
     for i in range(len(As)-1):
-      if As[i].a!=[]:
+      if As[i].a!=():
         if As[i].a[0].id==B.id and B.id not in Var(As[i].a[1],NOM) and found==-1: found = i
         elif B.id in Var(As[i],NOM): 
           found = -1
@@ -511,12 +872,12 @@ def simpl_left(As): # As is a quasiequation
 
 def simpl_right(As):
   A = As[-1]
-  if A.a==[]: return As
+  if A.a==(): return As
   B = A.a[1]
   if B.id in CNOM and B.id not in Var(A.a[0],CNOM):
     found = -1
     for i in range(len(As)-1):
-      if As[i].a!=[]:
+      if As[i].a!=():
         if As[i].a[1].id==B.id and B.id not in Var(As[i].a[0],CNOM) and found==-1: found = i
         elif B.id in Var(As[i],CNOM): 
           found = -1
@@ -526,25 +887,29 @@ def simpl_right(As):
     return As[:i]+As[i+1:-1]+[fm(A.id,[A.a[0],As[i].a[0]])]
   return As
 
-def signedwrap(subt,t,pol): # decide when to add parentheses
-    return signed(subt,pol) if subt.lbp > t.lbp or subt.a==[] else "("+signed(subt,pol)+")"
+def signedwrap(subt,t,st): # decide when to add parentheses (st is the signed LaTeX string of subt)
+    return st if subt.lbp > t.lbp or subt.a==() else "("+st+")"
 
 def signed(A,pol): #LaTeX string of the signed formula
-  if A.a==[]: return "\\stackrel"+("+" if pol else "-")+repr(A)
-  if A.id in NEG: return "\\stackrel"+("+" if pol else "-")+A.id+signedwrap(A.a[0],A,not pol)
-  else: return signedwrap(A.a[0],A,pol!=(A.id in NP0))+"\\stackrel"+("+" if pol else "-")+\
-                         A.id+" "+signedwrap(A.a[1],A,pol!=(A.id in PN0))
+  return trampoline(signed_steps,(A,pol))
 
-def spass(A): #output the formula A in SPASS format
-  if A.a==[]: return repr(A).replace("_","").replace("{","").replace("}","").upper()
-  return A.id.replace("\\l","").replace("\\","")+"("+",".join([spass(B) for B in A.arg])+")"
+def signed_steps(x): # signed as a recursive generator (see trampoline)
+  A,pol = x
+  if A.a==(): return "\\stackrel"+("+" if pol else "-")+repr(A)
+  if A.id in NEG: return "\\stackrel"+("+" if pol else "-")+A.id+signedwrap(A.a[0],A,(yield (A.a[0],not pol)))
+  else: return signedwrap(A.a[0],A,(yield (A.a[0],pol!=(A.id in NP0))))+"\\stackrel"+("+" if pol else "-")+\
+                         A.id+" "+signedwrap(A.a[1],A,(yield (A.a[1],pol!=(A.id in PN0))))
 
 def varsInNegArrowOrPosCirc(A,pol):
-  if A.a==[]: return set([])
-  if A.id in NEG: return varsInNegArrowOrPosCirc(A.a[0], not pol)
-  if pol and A.id==Mult or not pol and A.id==Rimp: return set(signedVars(A, pol))
-  return varsInNegArrowOrPosCirc(A.a[0],pol!=(A.id in NP0))\
-       | varsInNegArrowOrPosCirc(A.a[1],pol!=(A.id in PN0))
+  V = set([])
+  stack = [(A,pol)]
+  while stack:
+    A,pol = stack.pop()
+    if A.a==(): continue
+    if A.id in NEG: stack.append((A.a[0], not pol))
+    elif pol and A.id==Mult or not pol and A.id==Rimp: V |= set(signedVars(A, pol))
+    else: stack += [(A.a[0],pol!=(A.id in NP0)),(A.a[1],pol!=(A.id in PN0))]
+  return V
 
 def nFO(A): #replace nominal with FO variable
   return fm(A.id.replace("\\mathbf j","x").replace("\\mathbf i","x_0"),[])
@@ -563,13 +928,22 @@ def cSimp(A): # if A is an implication of two negated formulas, contrapose A
     #if equal(A.a[0],A.a[1]): return fm(TRUE,[])
   return A
 
-def  tr(A): # A is a pure quasiequation (=list of inequations), translate it to FO formula
+def tr(A): # A is a pure quasiequation (=list of inequations), translate it to FO formula
+  return trampoline(tr_steps, A)
+
+def  tr_steps(A): # tr as a recursive generator: (yield B) translates B (see trampoline)
   if type(A)==str: return A
   if type(A)==list:
-    if len(A)==1: return tr(A[0])
-    if len(A)==2: return cSimp(fm(Imp,[tr(A[0]),tr(A[1])]))
-    return cSimp(fm(Imp,[tr(tuple(A[0:-1])),tr(A[-1])]))
-  if type(A)==tuple: return fm(And,[tr(A[0]),tr(A[1:])]) if len(A)>1 else tr(A[0])
+    if len(A)==1: return (yield A[0])
+    if len(A)==2: return cSimp(fm(Imp,[(yield A[0]),(yield A[1])]))
+    return cSimp(fm(Imp,[(yield tuple(A[0:-1])),(yield A[-1])]))
+  if type(A)==tuple:
+    if len(A)==1: return (yield A[0])
+    Bs = [] # premises are translated in order and conjoined to the right
+    for B in A: Bs.append((yield B))
+    B = Bs[-1]
+    for C in reversed(Bs[:-1]): B = fm(And,[C,B])
+    return B
   if A.id in [TRUE,FALSE]: return A
   if A.id==Le:
     if A.a[0].id in NOM:
@@ -583,37 +957,37 @@ def  tr(A): # A is a pure quasiequation (=list of inequations), translate it to
           if A.a[1].a[1].id in NOM:
             return fm(RMrel,[nFO(A.a[1].a[0]),nFO(A.a[1].a[1]),nFO(A.a[0])])
           j = get_NOM(); x = nFO(j)
-          return fm(Exists+" "+x.id,[fm(And,[tr(fm(Le,[j,A.a[1].a[1]])),
+          return fm(Exists+" "+x.id,[fm(And,[(yield fm(Le,[j,A.a[1].a[1]])),
                                              fm(RMrel,[nFO(A.a[1].a[0]),x,nFO(A.a[0])])])])
         if A.a[1].a[1].id in NOM:
           j = get_NOM(); x = nFO(j)
-          return fm(Exists+" "+x.id,[fm(And,[tr(fm(Le,[j,A.a[1].a[0]])),
+          return fm(Exists+" "+x.id,[fm(And,[(yield fm(Le,[j,A.a[1].a[0]])),
                                              fm(RMrel,[x,nFO(A.a[1].a[1]),nFO(A.a[0])])])])
         j = get_NOM(); x = nFO(j); k = get_NOM(); y = nFO(k)
-        return fm(Exists+" "+x.id,[fm(Exists+" "+y.id,[fm(And,[fm(And,[tr(fm(Le,[j,A.a[1].a[0]])),
-                  tr(fm(Le,[k,A.a[1].a[1]]))]),fm(RMrel,[x,y,nFO(A.a[0])])])])])
+        return fm(Exists+" "+x.id,[fm(Exists+" "+y.id,[fm(And,[fm(And,[(yield fm(Le,[j,A.a[1].a[0]])),
+                  (yield fm(Le,[k,A.a[1].a[1]]))]),fm(RMrel,[x,y,nFO(A.a[0])])])])])
       if A.a[1].id==Rimp:  # i <= A->B ---> ioA <= B
-        return tr(fm(Le,[fm(Mult,[A.a[0],A.a[1].a[0]]),A.a[1].a[1]]))
+        return (yield fm(Le,[fm(Mult,[A.a[0],A.a[1].a[0]]),A.a[1].a[1]]))
       if A.a[1].id==Limp:  # i <= A<-B ---> Boi <= A
-        return tr(fm(Le,[fm(Mult,[A.a[0],A.a[1].a[0]]),A.a[1].a[1]]))
+        return (yield fm(Le,[fm(Mult,[A.a[0],A.a[1].a[0]]),A.a[1].a[1]]))
       if A.a[1].id==Himp:  # i <= A=>B ---> i^A <= B
-        return  tr(fm(Le,[fm(Meet,[A.a[0],A.a[1].a[0]]),A.a[1].a[1]]))
+        return  (yield fm(Le,[fm(Meet,[A.a[0],A.a[1].a[0]]),A.a[1].a[1]]))
       if A.a[1].id==Coimp: # i <= A-<B ---> all y_n(A-<B <= n ==> i <= n)
         n = get_CNOM()
-        return fm(All+" "+cFO(n).id,[cSimp(fm(Imp,[ tr(fm(Le,[A.a[1],n])),tr(fm(Le,[A.a[0],n]))]))])
+        return fm(All+" "+cFO(n).id,[cSimp(fm(Imp,[ (yield fm(Le,[A.a[1],n])),(yield fm(Le,[A.a[0],n]))]))])
       if A.a[1].id==Meet:  # i <= A^B ---> i <= A and i <= B
-        return fm(And,[tr(fm(Le,[A.a[0],A.a[1].a[0]])),tr(fm(Le,[A.a[0],A.a[1].a[1]]))])
+        return fm(And,[(yield fm(Le,[A.a[0],A.a[1].a[0]])),(yield fm(Le,[A.a[0],A.a[1].a[1]]))])
       if A.a[1].id==Join:  # i <= AvB ---> i <= A or i <= B
-        return fm(Or,[tr(fm(Le,[A.a[0],A.a[1].a[0]])),tr(fm(Le,[A.a[0],A.a[1].a[1]]))])
+        return fm(Or,[(yield fm(Le,[A.a[0],A.a[1].a[0]])),(yield fm(Le,[A.a[0],A.a[1].a[1]]))])
       if A.a[1].id==Galcon:  # i <= ~^#A
-        return tr(fm(Le,[A.a[1].a[0],fm(Invol,[A.a[0]])]))
+        return (yield fm(Le,[A.a[1].a[0],fm(Invol,[A.a[0]])]))
       if A.a[1].id==Invol:  # i <= ~A
         if A.a[1].a[0].id in CNOM: # i <= ~m
           return fm(RMle,[fm(RMinvol,[nFO(A.a[0])]),cFO(A.a[1].a[0])])
         if A.a[1].a[0].id in NOM: # i <= ~j
           return fm(RMnle,[nFO(A.a[1].a[0]),fm(RMinvol,[nFO(A.a[0])])])
         j = get_NOM(); x = nFO(j)
-        return fm(All+" "+x.id,[cSimp(fm(Imp,[tr(fm(Le,[j,A.a[1].a[0]])),
+        return fm(All+" "+x.id,[cSimp(fm(Imp,[(yield fm(Le,[j,A.a[1].a[0]])),
                                               fm(RMnle,[x,fm(RMinvol,[nFO(A.a[0])])])]))])
       print("missing j <= A case")
       return A
@@ -627,47 +1001,434 @@ def  tr(A): # A is a pure quasiequation (=list of inequations), translate it to
           if A.a[0].a[1].id in NOM:
             return fm(Not,[fm(RMrel,[nFO(A.a[0].a[0]),nFO(A.a[0].a[1]),cFO(A.a[1])])])
           j = get_NOM(); x = nFO(j)
-          return fm(All+" "+x.id,[cSimp(fm(Imp,[tr(fm(Le,[j,A.a[0].a[1]])),
+          return fm(All+" "+x.id,[cSimp(fm(Imp,[(yield fm(Le,[j,A.a[0].a[1]])),
                                     fm(Not,[fm(RMrel,[nFO(A.a[0].a[0]),x,cFO(A.a[1])])])]))])
         if A.a[0].a[1].id in NOM:
           j = get_NOM(); x = nFO(j)
-          return fm(All+" "+x.id,[cSimp(fm(Imp,[tr(fm(Le,[j,A.a[0].a[0]])),
+          return fm(All+" "+x.id,[cSimp(fm(Imp,[(yield fm(Le,[j,A.a[0].a[0]])),
                                     fm(Not,[fm(RMrel,[x,nFO(A.a[0].a[1]),cFO(A.a[1])])])]))])
         j = get_NOM(); x = nFO(j)
         k = get_NOM(); y = nFO(k)
         return fm(All+" "+x.id,[fm(All+" "+y.id,[fm(Imp,[ #MISSING CSIMP?
-                    fm(And,[tr(fm(Le,[j,A.a[0].a[0]])), tr(fm(Le,[k,A.a[0].a[1]]))]),
+                    fm(And,[(yield fm(Le,[j,A.a[0].a[0]])), (yield fm(Le,[k,A.a[0].a[1]]))]),
                     fm(Not,[fm(RMrel,[x,y,cFO(A.a[1])])])])])])
       if A.a[0].id==Himp: # A=>B <= n ---> all x_j(j <= A=>B ==> j <= n)
         j = get_NOM(); x = nFO(j)
-        return fm(All+" "+x.id,[cSimp(fm(Imp,[tr(fm(Le,[j,A.a[0]])), tr(fm(Le,[j,A.a[1]]))]))])
+        return fm(All+" "+x.id,[cSimp(fm(Imp,[(yield fm(Le,[j,A.a[0]])), (yield fm(Le,[j,A.a[1]]))]))])
       if A.a[0].id==Coimp: # A-<B <= n ---> A <= B v n
-        return tr(fm(Le,[fm(Join,[A.a[0].a[0],A.a[0].a[1]]),A.a[1]]))
+        return (yield fm(Le,[fm(Join,[A.a[0].a[0],A.a[0].a[1]]),A.a[1]]))
       if A.a[0].id==Dualgc:  # i <= ~^#A
-        return tr(fm(Le,[fm(Invol,[A.a[1]]),A.a[0].a[0],]))
+        return (yield fm(Le,[fm(Invol,[A.a[1]]),A.a[0].a[0],]))
       if A.a[0].id==Invol:  # ~A <= n
         if A.a[0].a[0].id in CNOM: # ~m <= n
           return fm(RMnle,[fm(RMinvol,[cFO(A.a[1])]),cFO(A.a[0].a[0])])
         if A.a[0].a[0].id in NOM: # ~j <= n
           return fm(RMle,[nFO(A.a[0].a[0]),fm(RMinvol,[cFO(A.a[1])])])
         j = get_NOM(); x = nFO(j)
-        return fm(Exists+" "+x.id,[fm(And,[tr(fm(Le,[j,A.a[0].a[0]])),
+        return fm(Exists+" "+x.id,[fm(And,[(yield fm(Le,[j,A.a[0].a[0]])),
                                            fm(RMle,[x,fm(RMinvol,[cFO(A.a[1])])])])])
       if A.a[0].id==Rimp:
         if A.a[0].a[0].id in NOM:
           if A.a[0].a[1].id in CNOM:
             return fm(RMrel,[cFO(A.a[1]),nFO(A.a[0].a[0]),cFO(A.a[0].a[1])])
       if A.a[0].id==Meet:  # A^B <= m ---> A <= m or B <= m
-        return fm(Or,[tr(fm(Le,[A.a[0].a[0],A.a[1]])),tr(fm(Le,[A.a[0].a[1],A.a[1]]))])
+        return fm(Or,[(yield fm(Le,[A.a[0].a[0],A.a[1]])),(yield fm(Le,[A.a[0].a[1],A.a[1]]))])
       if A.a[0].id==Join:  # AvB <= m ---> A <= m and B <= m
-        return fm(And,[tr(fm(Le,[A.a[0].a[0],A.a[1]])),tr(fm(Le,[A.a[0].a[1],A.a[1]]))])
+        return fm(And,[(yield fm(Le,[A.a[0].a[0],A.a[1]])),(yield fm(Le,[A.a[0].a[1],A.a[1]]))])
       print("missing A <= m case")
       return A
     j = get_NOM()
-    return fm(All+" "+nFO(j).id,[cSimp(fm(Imp,[tr(fm(Le,[j,A.a[0]])),tr(fm(Le,[j,A.a[1]]))]))])
+    return fm(All+" "+nFO(j).id,[cSimp(fm(Imp,[(yield fm(Le,[j,A.a[0]])),(yield fm(Le,[j,A.a[1]]))]))])
   print("missing a case: "+A.id)
   return A
 
+### Duplicate and subsumed inclusions ##########################
+
+# Stage between approximate and eliminate. The premises of a quasi-inclusion are universally quantified
+# over its (co-)nominals, so a group of premises whose fresh (indexed) nominals occur nowhere else in
+# it can be dropped if another such group is the same up to a renaming of them; a premise can also be
+# dropped if it holds in every lattice (A\le A, \bot\le A, A\land B\le A, ...) or follows from another
+# premise with the same left (right) side and a larger right (smaller left) side. Quasi-inclusions of
+# the list that only differ in the names of their fresh nominals are kept once.
+
+FRESH = Nominals(frozenset(),(NOM.prefix,CNOM.prefix)) # the fresh (indexed) nominals and co-nominals
+
+def shape(As): # a key of the list of formulas As that does not change when nominals are renamed
+  return tuple((A.id,A.n) for A in As)
+
+def alpha_key(As): # As with the fresh (co-)nominals renamed by order of occurrence, as a tuple
+  m = {}; count = {True:0, False:0}
+  def f(B, Cs):
+    if B.a!=(): return fm(B.id,Cs)
+    if B.id not in FRESH: return B
+    if B.id not in m:
+      k = B.id.startswith(NOM.prefix)
+      m[B.id] = (nominal if k else conominal)(count[k])
+      count[k] += 1
+    return m[B.id]
+  memo = {}
+  return tuple(fold(A,f,memo) for A in As)
+
+def first_occurrences(L, key): # the members of L for which no earlier member has the same key(x); key
+  # is only computed for members with the same shape as an earlier one
+  shapes = {}; Ks = set(); out = []
+  for x in L:
+    S = shape(x)
+    if S in shapes:
+      if shapes[S] is not None: # compute the key of the first member of this shape only when needed
+        Ks.add(key(shapes[S])); shapes[S] = None
+      K = key(x)
+      if K in Ks: continue
+      Ks.add(K)
+    else: shapes[S] = x
+    out.append(x)
+  return out
+
+def lattice_true(A): # the inclusion A holds in every lattice (by a single syntactic rule)
+  if A.id!=Le: return False
+  B, C = A.a
+  return B==C or B.id==Bot or C.id==Top or (B.id==Meet and C in B.a) or (C.id==Join and B in C.a)
+
+def entailed(As): # the set of inclusions in As that follow from another one of them by a single syntactic
+  # rule: A\le B from A\le B\land C, and A\le B from A\lor C\le B
+  meets = {}; joins = {}
+  for A in As:
+    if A.id==Le:
+      if A.a[1].id==Meet: meets.setdefault(A.a[0],set()).update(conjuncts(A.a[1],Meet))
+      if A.a[0].id==Join: joins.setdefault(A.a[1],set()).update(conjuncts(A.a[0],Join))
+  if meets=={} and joins=={}: return set()
+  return set(A for A in As if A.id==Le and (A.a[1] in meets.get(A.a[0],()) or A.a[0] in joins.get(A.a[1],())))
+
+def prune(Bs): # premises of the quasi-inclusion Bs without duplicate or subsumed ones, and the conclusion
+  Ps = list(dict.fromkeys(B for B in Bs[:-1] if not lattice_true(B))) # exact duplicates are hash-consed
+  E = entailed(Ps)
+  if E: Ps = [B for B in Ps if B not in E]
+  if len(set(shape(Ps)))==len(Ps): return Ps+[Bs[-1]] # no two groups of premises can have the same shape
+  N = {B:Var(B,FRESH) for B in Ps}
+  comp = {} # union-find of the fresh (co-)nominals that occur in the same premise
+  def find(x):
+    while comp[x]!=x: x = comp[x]
+    return x
+  for B in Ps:
+    L = list(N[B])
+    for x in L: comp.setdefault(x,x)
+    for x in L[1:]: comp[find(x)] = find(L[0])
+  anchor = set(find(x) for x in Var(Bs[-1],FRESH) if x in comp) # groups that meet the conclusion
+  groups = {}
+  for i,B in enumerate(Ps):
+    g = find(next(iter(N[B]))) if N[B] else i
+    groups.setdefault(g,[]).append(B)
+  Ls = [L for g,L in groups.items() if g not in anchor]
+  if len(Ls)>1:
+    keep = set(id(L) for L in first_occurrences(Ls,alpha_key))
+    drop = set(B for L in Ls if id(L) not in keep for B in L)
+    if drop: Ps = [B for B in Ps if B not in drop]
+  return Ps+[Bs[-1]]
+
+### First-order compaction #####################################
+
+# Optional pass on the output of translate: one-point rules for quantifiers bounded by \preceq (or =),
+# miniscoping, removal of duplicate conjuncts/disjuncts, constants and vacuous quantifiers, and
+# finally a compact renaming of the bound variables. The one-point rules use the monotonicity of
+# the frame relations: R is antitone in its first two arguments and monotone in the third, O is
+# up-closed, ^* is antitone, and x\preceq y (x\not\preceq y) is antitone (monotone) in x
+
+FOMONO = {RMrel:(-1,-1,1), RMiden:(1,), RMle:(-1,1), RMnle:(1,-1)} # direction of each argument
+
+def quantifier(A): # (All or Exists, bound variable) if A is a quantified formula, else None
+  for Q in QUANT:
+    if A.id.startswith(Q+" "): return (Q, A.id[len(Q)+1:])
+  return None
+
+def free_vars(A, memo): # frozenset of the free FO variables of A (memo: subformula -> result)
+  def f(B, Vs):
+    if B.a==(): return frozenset() if B.id in CONST else frozenset([B.id])
+    V = frozenset().union(*Vs)
+    q = quantifier(B)
+    return V-{q[1]} if q else V
+  return fold(A, f, memo)
+
+def bound_vars(A): # set of the variables bound by quantifiers in A
+  return set(q[1] for q in map(quantifier, subformulas(A)) if q)
+
+def subformulas(A): # the distinct subformulas of A
+  S = set(); stack = [A]
+  while stack:
+    B = stack.pop()
+    if B not in S:
+      S.add(B); stack += B.a
+  return S
+
+def directions(A, x): # set of directions of the free occurrences of x in A: 1 (A is monotone
+  # in this occurrence), -1 (antitone) or 0 (unknown, e.g. inside =, \neq or \iff)
+  D = set()
+  stack = [(A,1)]
+  while stack:
+    B, s = stack.pop()
+    q = quantifier(B)
+    if q:
+      if q[1]!=x: stack.append((B.a[0],s))
+    elif B.id in (And,Or): stack += [(C,s) for C in B.a]
+    elif B.id==Not: stack.append((B.a[0],-s))
+    elif B.id==Imp: stack += [(B.a[0],-s),(B.a[1],s)]
+    elif B.id in FOMONO:
+      for C,t in zip(B.a,FOMONO[B.id]):
+        t *= s
+        while C.id==RMinvol: C = C.a[0]; t = -t
+        if C.id==x: D.add(t)
+        elif x in Var(C,{x}): D.add(0)
+    elif x in Var(B,{x}): D.add(0)
+  return D
+
+def conjuncts(A, op=And): # members of a (nested) conjunction or disjunction A, left to right
+  L = []; stack = [A]
+  while stack:
+    B = stack.pop()
+    if B.id==op: stack += reversed(B.a)
+    else: L.append(B)
+  return L
+
+def conjoin(L, op=And): # right nested conjunction (or disjunction) of the formulas in L
+  if L==[]: return fm(TRUE if op==And else FALSE,[])
+  B = L[-1]
+  for C in reversed(L[:-1]): B = fm(op,[C,B])
+  return B
+
+def substitute(A, x, t): # replace the free variable x by the term t in A
+  def f(B, Cs):
+    if B.id==x: return t
+    return B if Cs==list(B.a) else fm(B.id,Cs)
+  return fold(A, f)
+
+def one_point(A, fv): # \exists x(x\preceq t\land B) ---> B[t/x] if B is monotone in x, etc.
+  Q, x = quantifier(A)
+  B = A.a[0]
+  if Q==Exists: Gs = conjuncts(B); rest = lambda L: conjoin(L)
+  elif B.id==Imp: Gs = conjuncts(B.a[0]); rest = lambda L: fm(Imp,[conjoin(L),B.a[1]]) if L else B.a[1]
+  else: return None
+  for i,G in enumerate(Gs):
+    if G.id not in (RMle,Eq): continue
+    for k in (0,1):
+      if G.a[k].id!=x or x in free_vars(G.a[1-k],fv): continue
+      t = G.a[1-k]
+      C = rest(Gs[:i]+Gs[i+1:])
+      if G.id==RMle: # t\preceq x needs C antitone (for \exists) or monotone (for \forall) in x
+        d = (1 if k==0 else -1)*(1 if Q==Exists else -1)
+        if directions(C,x)-{d}: continue
+      Bs = bound_vars(C)
+      if x in Bs or free_vars(t,fv)&Bs: continue # avoid capture
+      return substitute(C,x,t)
+  return None
+
+def miniscope(A, fv): # move the parts of the scope of a quantifier that do not contain its variable out
+  Q, x = quantifier(A)
+  B = A.a[0]
+  op = And if Q==All else Or
+  if B.id==(Or if Q==All else And):
+    Cs = conjuncts(B,B.id)
+    In = [C for C in Cs if x in free_vars(C,fv)]
+    if len(In)==len(Cs): return None
+    return conjoin([C for C in Cs if C not in In]+[fm(A.id,[conjoin(In,B.id)])],B.id)
+  if Q==All and B.id==Imp:
+    if x not in free_vars(B.a[1],fv): # \forall x(C\implies D) ---> \exists x C\implies D
+      return fm(Imp,[fm(Exists+" "+x,[B.a[0]]),B.a[1]])
+    if x not in free_vars(B.a[0],fv): return fm(Imp,[B.a[0],fm(A.id,[B.a[1]])])
+    Cs = conjuncts(B.a[0])
+    In = [C for C in Cs if x in free_vars(C,fv)]
+    if len(In)==len(Cs): return None
+    return fm(Imp,[conjoin([C for C in Cs if C not in In]),fm(A.id,[fm(Imp,[conjoin(In),B.a[1]])])])
+  return None
+
+def compact_step(A, fv): # one simplification of the formula A, or None
+  T = fm(TRUE,[]); F = fm(FALSE,[])
+  if A.id in (RMle,Eq) and A.a[0] is A.a[1]: return T
+  if A.id in (RMnle,Neq) and A.a[0] is A.a[1]: return F
+  if A.id==Not:
+    B = A.a[0]
+    if B.id==TRUE: return F
+    if B.id==FALSE: return T
+    if B.id==Not: return B.a[0]
+    if B.id==RMle: return fm(RMnle,list(B.a))
+    if B.id==RMnle: return fm(RMle,list(B.a))
+    return None
+  if A.id==Imp:
+    B, C = A.a
+    if B.id==TRUE: return C
+    if B.id==FALSE or C.id==TRUE or C in conjuncts(B) or B in conjuncts(C,Or): return T
+    if C.id==FALSE: return fm(Not,[B])
+    return None
+  if A.id in (And,Or):
+    unit, zero = (TRUE,FALSE) if A.id==And else (FALSE,TRUE)
+    Cs = conjuncts(A,A.id)
+    if any(C.id==zero for C in Cs): return fm(zero,[])
+    L = []; keys = set() # members are compared up to renaming of bound variables
+    for C in Cs:
+      k = alpha_fo(C)
+      if C.id!=unit and k not in keys:
+        L.append(C); keys.add(k)
+    dual = Or if A.id==And else And # absorption: P\land(P\lor Q) ---> P
+    L = [C for C in L if C.id!=dual or not any(alpha_fo(D) in keys for D in conjuncts(C,dual))]
+    return None if len(L)==len(Cs) else conjoin(L,A.id)
+  q = quantifier(A)
+  if q:
+    if q[1] not in free_vars(A.a[0],fv): return A.a[0]
+    B = one_point(A,fv)
+    return B if B is not None else miniscope(A,fv)
+  return None
+
+def rename_bound(A, fv, letter=None): # rename each bound variable to x_k (or y_k) with k>0 as small as
+  # possible, avoiding the free variables of A and the variables of the enclosing quantifiers; with a
+  # letter, all bound variables are named letter_k
+  free = free_vars(A,fv)
+  def steps(X):
+    B, m = X
+    if B.a==(): return fm(m[B.id],[]) if B.id in m else B
+    q = quantifier(B)
+    if q:
+      used = free|set(m.values())
+      k = 1
+      x = letter or q[1][0]
+      while subscript(x,k) in used: k += 1
+      m = dict(m); m[q[1]] = subscript(x,k)
+      return fm(q[0]+" "+m[q[1]],[(yield (B.a[0],m))])
+    Cs = []
+    for C in B.a: Cs.append((yield (C,m)))
+    return fm(B.id,Cs)
+  return trampoline(steps,(A,{}))
+
+@lru_cache(maxsize=4096)
+def alpha_fo(A): # representative of A up to renaming of its bound variables
+  return rename_bound(A,{},"x") if bound_vars(A) else A
+
+def compactFO(A): # smaller equivalent of the FO formula A (the output of translate)
+  if type(A)==str: return A
+  fv = {}
+  n = A.n
+  def f(B, Cs): # B with simplified arguments Cs, simplified once more at the top
+    if Cs!=list(B.a): B = fm(B.id,Cs)
+    C = compact_step(B,fv)
+    return B if C is None else C
+  while True: # until no rule applies
+    B = fold(A,f)
+    if B is A: break
+    A = B
+  A = rename_bound(A,fv)
+  S = context().stats
+  if S is not None: S["compact"] = [n,A.n] # number of nodes before and after
+  return A
+
+### Inductive inequalities #####################################
+
+# Sahlqvist and inductive inequalities in the sense of unified correspondence, decided from one pass
+# over the signed generation tree of s\le t (+s and -t). A branch is good if it consists of skeleton
+# nodes followed by PIA nodes. An order type eps (the sign of the critical occurrences of each
+# variable) and a strict order Omega on the variables show that the inequality is inductive if every
+# critical branch is good and at each SRR node of its PIA part the other arguments are
+# eps^\partial-uniform and only contain variables below the critical one in Omega; it is Sahlqvist
+# if no critical branch has an SRR node in its PIA part
+
+SKELETON = {True:set([Join,Meet,Mult,Coimp,Invol,Dualgc]), False:set([Meet,Join,Rimp,Limp,Himp,Invol,Galcon])}
+PIA = {True:{Meet:"SRA",Invol:"SRA",Galcon:"SRA",Rimp:"SRR",Limp:"SRR",Himp:"SRR"},
+       False:{Join:"SRA",Invol:"SRA",Dualgc:"SRA",Mult:"SRR",Coimp:"SRR"}}
+
+def arg_signs(A, sign): # signs of the arguments of A in a signed generation tree
+  if A.id in NEG: return [not sign]
+  if A.id in NP0: return [not sign, sign]
+  if A.id in PN0: return [sign, not sign]
+  return [sign]*len(A.a)
+
+def signed_occurrences(A, memo): # frozenset of (variable, sign) of the occurrences in +A
+  def f(B, Ss):
+    if B.a==(): return frozenset([(B.id,True)]) if B.id in VAR else frozenset()
+    S = set()
+    for T,s in zip(Ss,arg_signs(B,True)): S |= T if s else set((p,not t) for p,t in T)
+    return frozenset(S)
+  return fold(A, f, memo)
+
+def branches(A): # list of (variable, sign, why the branch is not good or None, SRR side branches) for
+  # the variable occurrences in the inequality A; the side branches are a linked list (pairs of a
+  # tuple of (formula, sign) and the rest) so that branches share them
+  occ = []
+  stack = [(A.a[0],True,None,None,None),(A.a[1],False,None,None,None)]
+  while stack: # top: (sign, operation) of the first node that is not a skeleton node
+    B, s, top, bad, sides = stack.pop()
+    if B.a==():
+      if B.id in VAR: occ.append((B.id,s,bad,sides))
+      continue
+    sg = "+" if s else "-"
+    if top is None and B.id not in SKELETON[s]: top = sg+B.id
+    kind = PIA[s].get(B.id) if top is not None else None
+    if top is not None and kind is None and bad is None: bad = sg+B.id+" (not PIA) under "+top+" (not skeleton)"
+    signs = arg_signs(B,s)
+    for k,C in enumerate(B.a):
+      S = sides
+      if kind=="SRR" and bad is None: S = (tuple((D,t) for j,(D,t) in enumerate(zip(B.a,signs)) if j!=k),sides)
+      stack.append((C,signs[k],top,bad,S))
+  return occ
+
+def topological_order(V, edges): # V sorted so that q comes before p for the edges p -> q, None if cyclic
+  order = []; state = {} # 1: being visited, 2: done
+  for p in V:
+    if p in state: continue
+    state[p] = 1
+    stack = [(p,iter(edges.get(p,())))]
+    while stack:
+      q, it = stack[-1]
+      r = next(it, None)
+      if r is None:
+        stack.pop(); state[q] = 2; order.append(q)
+      elif state.get(r)==1: return None
+      elif r not in state:
+        state[r] = 1; stack.append((r,iter(edges.get(r,()))))
+  return order
+
+def inductive(A): # (class, polarity, order, reason) for the inequality A (see classify)
+  occ = branches(A)
+  V = sorted(set(o[0] for o in occ))
+  memo = {}
+  local = {}; needs = {}; srr = {} # for each (variable, sign of its critical occurrences)
+  for p in V:
+    for e in (True,False):
+      local[p,e] = None; needs[p,e] = set(); srr[p,e] = False
+  done = set() # (id of a side branch list, variable, sign) already added to needs
+  for p,s,bad,sides in occ:
+    if bad is not None and local[p,s] is None: local[p,s] = ("+" if s else "-")+p+" is below "+bad
+    while sides is not None and (id(sides),p,s) not in done:
+      done.add((id(sides),p,s))
+      srr[p,s] = True
+      for D,t in sides[0]: needs[p,s] |= set((q,u==t) for q,u in signed_occurrences(D,memo))
+      sides = sides[1]
+  for p in V:
+    for e in (True,False):
+      if any(q==p for q,u in needs[p,e]) and local[p,e] is None:
+        local[p,e] = ("+" if e else "-")+p+" has an occurrence of "+p+" in a side branch"
+  choices = [] # possible signs of critical occurrences for each variable
+  for p in V:
+    E = [e for e in (True,False) if local[p,e] is None]
+    if E==[]: return "non-inductive", None, None, local[p,True]+"; "+local[p,False]
+    if not any(o[0]==p and o[1]==E[0] for o in occ): E = E[:1] # no critical occurrences for this sign
+    elif len(E)==2 and not any(o[0]==p and o[1]==E[1] for o in occ): E = E[1:]
+    choices.append(E)
+  found = None; reason = None
+  for signs in product(*choices):
+    eps = dict(zip(V,signs))
+    edges = {}
+    why = None
+    for p in V:
+      for q,u in needs[p,eps[p]]:
+        if eps[q]==u:
+          why = ("+" if u else "-")+q+" is critical in a side branch of "+("+" if eps[p] else "-")+p
+        edges.setdefault(p,set()).add(q)
+    order = None if why else topological_order(V,{p:sorted(Q) for p,Q in edges.items()})
+    if order is None:
+      if reason is None: reason = why or "the side branches of "+", ".join(("+" if eps[p] else "-")+p
+                                           for p in V if needs[p,eps[p]])+" depend on each other cyclically"
+      continue
+    pol = {p:"+" if eps[p] else "-" for p in V}
+    if not any(srr[p,eps[p]] for p in V): return "Sahlqvist", pol, order, None
+    if found is None: found = ("inductive", pol, order, None)
+  return found or ("non-inductive", None, None, reason)
+
 ### User commands ##############################################
 
 def signedformula(st,sign=True): # input (raw) LaTeX formula, output LaTeX signed LaTeX string
@@ -680,21 +1441,30 @@ def Sahlqvist(st): #check if LaTeX string is a Sahlqvist formula
     if V[i]==V[i+1]: return V[i]+" occurrs + and - in scope of -\\to or +\\circ"
   return True
 
+def classify(st): # decide if the formula st (LaTeX or parsed) is a Sahlqvist or inductive
+  # inequality (see inductive) without running the algorithm; returns a dict with "class"
+  # ("Sahlqvist", "inductive" or "non-inductive"), "polarity" (variable -> "+" or "-", the sign of its
+  # critical occurrences), "order" (the variables, each after those its critical branches depend on)
+  # and "reason" (why no polarity and order work, or None)
+  A = as_inequality(parse(st) if type(st)==str else st)
+  return dict(zip(("class","polarity","order","reason"),inductive(A)))
+
+def as_inequality(A): # the inequality that is valid iff the formula A is (t\le A, or B\le C for A = B\to C)
+  if A.id==Rimp: return fm(Le,[A.a[0],A.a[1]])
+  if A.id!=Le: return fm(Le,[parse("\\mathbf t"),A])
+  return A
+
 def preprocess(st,info=True): # st is a single formula (LaTeX string), output is a list of inclusion formulas
   A = parse(st)
-  if info: 
-    display(Math("\\ "))
-    show(A,info)
-  if A.id==Rimp:
-    A = fm(Le,[A.a[0],A.a[1]])
-  elif A.id!=Le:
-    A = fm(Le,[parse("\\mathbf t"),A])
-  As = mono_var_elim(split(A))
+  if info==True: display_math("\\ ")
+  if info: show(A,info)
+  A = as_inequality(A)
+  As = [mono_var_elim(B) for B in isplit(A)]
   if info: show(As,info)
   return As
 
 def approximate(As,info=True): # apply approximation rules exhaustively (starting with first approximation)
-  global freshNOM, freshCNOM
+  c = context()
   Cs = []
   for B in As:
     if len(Var(B))==0: Bs = [B]
@@ -704,8 +1474,8 @@ def approximate(As,info=True): # apply approximation rules exhaustively (startin
       if info: showq(Bs,info)
       C = Bs[-1] #store conclusion
       Bs = Bs[:-1]
-      freshCNOM = 0
-      freshNOM = 0
+      c.freshCNOM = 0
+      c.freshNOM = 0
       fixed = [] #can't be approx or split
       while Bs!=[]:
         Ds = appr_all(Bs)
@@ -725,11 +1495,21 @@ def approximate(As,info=True): # apply approximation rules exhaustively (startin
     Cs.append(Bs)
   return Cs
 
-def eliminate(As, info=True):
+def subsume(As, info=True): # remove duplicate and subsumed inclusions and quasi-inclusions (see prune)
+  n = sum(len(Bs) for Bs in As)
+  Ds = first_occurrences([prune(Bs) for Bs in As],alpha_key)
+  m = sum(len(Bs) for Bs in Ds)
+  S = context().stats
+  if S is not None: S["subsumed"] += n-m
+  if info and m<n:
+    for Bs in Ds: showq(Bs,info)
+  return Ds
+
+def eliminate(As, info=True, search=False):
   Ds = []
   for Bs in As:
     V = set(p for B in Bs for p in Var(B))
-    Cs = elim(Bs, V, [], info)
+    Cs = elim(Bs, V, [], info, search)
     if info: 
       if info==True and type(Cs)==str: print(Cs)
       else: showq(Cs,info)
@@ -751,17 +1531,21 @@ def simplify(As, info=True):
     Cs = [B for B in Cs[:-1] if B.id!=TRUE]+[Cs[-1]]
     #if any(B.id==FALSE for B in Cs[:-1]) or Cs[-1].id==TRUE: 
     #  Cs = [fm(Le,[fm("\\mathbf i",[]),fm("\\mathbf i",[])])]
-    showq(Cs,info)
+    if info: showq(Cs,info)
     Ds.append(Cs)
   return Ds
 
 def translate(A): # input a list of quasiequations
   if type(A)==str: return A
   if type(A)==list and type(A[0])==list:
-    return fm(And,[tr(A[0]),translate(A[1:])]) if len(A)>1 else tr(A[0])
+    Bs = [tr(B) for B in A] # conjunction of the translations, nested to the right
+    B = Bs[-1]
+    for C in reversed(Bs[:-1]): B = fm(And,[C,B])
+    return B
   return tr(A)
 
-def purify(st, info=True):
+@in_new_context
+def purify(st, info=True, search=False, profile=None, split_limit=None, split_budget=None):
   # purify(r"LaTeX formula")  prints intermediate steps (typeset) and returns the purified form of the 
   #   LaTeX formula or a string "explaining" why no purified formula exists
   #
@@ -772,21 +1556,810 @@ def purify(st, info=True):
   #
   # purify(r"LaTeX formula","latex") *prints* a list of all steps as LaTeX strings (with single \ format)
   #   useful for copy/paste into a LaTeX document
-  global output_list
-  output_list=[]
-  As = simplify(eliminate(approximate(preprocess(st,info),info),info),info)
-  if info=="steps": return output_list
+  #
+  # purify(r"LaTeX formula",False,"first") backtracks over variable orders and polarity choices if needed,
+  #   purify(r"LaTeX formula",False,"best") returns the smallest result over all of them (see elim)
+  #
+  # purify(r"LaTeX formula",False,split_limit=k,split_budget=m) gives up when splitting produces more than
+  #   k inclusions or m formula nodes in total, and the result is a string starting with "too large"
+  #
+  # purify(r"LaTeX formula",False,profile=d) also fills the dict d with the time of each stage and
+  #   counters of the work done (see new_stats); profile can also be a function that is called with them
+  c = context()
+  c.reset(split_limit,split_budget) # fresh (co-)nominals are numbered from 1 again
+  c.output_list = []
+  c.stats = None if profile is None else new_stats()
+  try:
+    As = stage("preprocess",preprocess,st,info)
+    As = stage("approximate",approximate,As,info)
+    As = stage("subsume",subsume,As,info)
+    As = stage("eliminate",eliminate,As,info,search)
+    As = stage("simplify",simplify,As,info)
+  except TooLarge as e: As = str(e)
+  finally: # counters are also reported if the call is interrupted (e.g. by a timeout)
+    if profile is not None: report(profile)
+  steps, c.output_list = c.output_list, [] # don't keep the steps alive after this call
+  if info=="steps": return steps
   if info=="latex":
-    for st in output_list: print(st)
+    for st in steps: print(st)
   else: return As
 
-def pearl(st, info=True): #this is the full algorithm, with output options similar to purify
-  global output_list
-  output_list=[]
-  As = reduce(translate(simplify(eliminate(approximate(preprocess(st,info),info),info),info)))
+@in_new_context
+def pearl(st, info=True, search=False, profile=None, compact=False, split_limit=None, split_budget=None):
+  # this is the full algorithm, with output options similar to purify
+  # compact=True also runs compactFO on the first-order correspondent
+  c = context()
+  c.reset(split_limit,split_budget) # fresh (co-)nominals are numbered from 1 again
+  c.output_list = []
+  c.stats = None if profile is None else new_stats()
+  try:
+    As = stage("preprocess",preprocess,st,info)
+    As = stage("approximate",approximate,As,info)
+    As = stage("subsume",subsume,As,info)
+    As = stage("eliminate",eliminate,As,info,search)
+    As = stage("simplify",simplify,As,info)
+    As = stage("translate",lambda As: reduce(translate(As)),As)
+    if compact and type(As)!=str:
+      n = As.n
+      As = stage("compact",compactFO,As)
+      show("\\text{compacted from "+str(n)+" to "+str(As.n)+" nodes}",info)
+  except TooLarge as e: As = str(e)
+  finally: # counters are also reported if the call is interrupted (e.g. by a timeout)
+    if profile is not None: report(profile)
   if info==True and type(As)!=str: show(As)
-  if info=="steps": return output_list+[str(As)]
+  steps, c.output_list = c.output_list, []
+  if info=="steps": return steps+[str(As)]
   if info=="latex":
-    for st in output_list: print(st)
+    for st in steps: print(st)
     print(As)
   else: return As
+
+### Batch processing ###########################################
+
+def reset(): # restore the run-time state that pearl/purify change (fresh nominal counters)
+  context().reset()
+
+class Timeout(Exception):
+  pass
+
+def alarm(signum, frame):
+  raise Timeout()
+
+def run_item(fn, st, info=False, timeout=None): # run fn(st,info) on fresh state and return a result record
+  # the record has keys "input", "status" ("ok", "failed", "error" or "timeout") and "result" or "error"
+  # "failed" means fn returned a string explaining why no result exists
+  reset()
+  rec = {"input":st}
+  timed = timeout and hasattr(signal,"setitimer") and threading.current_thread() is threading.main_thread()
+  if timed: handler = signal.signal(signal.SIGALRM, alarm)
+  try:
+    if timed: signal.setitimer(signal.ITIMER_REAL, timeout)
+    As = fn(st, info)
+    if timed: signal.setitimer(signal.ITIMER_REAL, 0)
+    rec["status"] = "failed" if type(As)==str else "ok"
+    rec["result"] = As
+  except Timeout:
+    rec["status"] = "timeout"
+    rec["error"] = "no result after "+str(timeout)+" seconds"
+  except Exception as e:
+    rec["status"] = "error"
+    rec["error"] = type(e).__name__+": "+str(e)
+  finally:
+    if timed:
+      signal.setitimer(signal.ITIMER_REAL, 0)
+      signal.signal(signal.SIGALRM, handler)
+  return rec
+
+def run_chunk(fn, sts, info=False, timeout=None): # worker task: a list of result records
+  return [run_item(fn, st, info, timeout) for st in sts]
+
+def batch(fn, formulas, workers=None, info=False, timeout=None, chunksize=16):
+  # generate the result records of fn (pearl or purify) for an iterable of formulas, in input order
+  # chunks of formulas are spread over a pool of worker processes (workers=1 runs in this process)
+  # at most 2*workers chunks are in progress, so formulas can be streamed from a large corpus
+  workers = workers or os.cpu_count() or 1
+  formulas = iter(formulas)
+  chunks = iter(lambda: list(islice(formulas, chunksize)), [])
+  if workers==1:
+    for sts in chunks: yield from run_chunk(fn, sts, info, timeout)
+    return
+  with ProcessPoolExecutor(workers) as pool:
+    pending = deque()
+    for sts in chunks:
+      pending.append(pool.submit(run_chunk, fn, sts, info, timeout))
+      if len(pending) >= 2*workers: yield from pending.popleft().result()
+    while pending: yield from pending.popleft().result()
+
+def pearl_many(formulas, workers=None, info=False, timeout=None, chunksize=16):
+  # pearl_many([r"LaTeX formula",...], workers=4) returns a list of result records (see run_item),
+  #   one for each formula in the same order; timeout (in seconds) limits the time for each formula
+  return list(batch(pearl, formulas, workers, info, timeout, chunksize))
+
+def purify_many(formulas, workers=None, info=False, timeout=None, chunksize=16):
+  # same as pearl_many, but each result is the purified form of the formula
+  return list(batch(purify, formulas, workers, info, timeout, chunksize))
+
+def classify_item(st, info=False): # classify(st) called the way batch calls pearl and purify
+  return classify(st)
+
+def classify_many(formulas, workers=None, timeout=None, chunksize=256):
+  # same as pearl_many, but each result is the dict of classify (for sorting out a corpus quickly)
+  return list(batch(classify_item, formulas, workers, False, timeout, chunksize))
+
+### Result cache ###############################################
+
+CANON = ["p","q","r"]+["p_"+str(i) for i in range(1,10)]+["p_0"] # variable names of canonical formulas
+CACHE_VERSION = "1" # change when results of purify/pearl change (cached results are then discarded)
+
+def rename(A, m): # rename the variables of formula A by the dict m (simultaneously)
+  return fold(A, lambda B,Bs: (fm(m[B.id],[]) if B.id in m else B) if B.a==() else fm(B.id,Bs))
+
+def canonical(A): # rename the variables of A to p,q,r,p_1,... in order of first (leftmost) occurrence
+  # return the renamed formula and the renaming back, or None if A has more variables than CANON
+  m = {}
+  stack = [A]
+  while stack!=[]:
+    B = stack.pop()
+    if B.id in VARFVAR and B.a==() and B.id not in m:
+      if len(m)==len(CANON): return None
+      m[B.id] = CANON[len(m)]
+    stack += B.a[::-1]
+  return rename(A,m), {v:k for k,v in m.items()}
+
+canon_re = re.compile(r"(?<![\\\w])("+"|".join(sorted(CANON,key=len,reverse=True))+r")(?!\w)")
+
+def rename_result(R, m): # rename the variables in a result of correspond (formulas, lists of them, strings)
+  if type(R)==str: return canon_re.sub(lambda x: m.get(x.group(1),x.group(1)), R)
+  if type(R) in (list,tuple): return type(R)(rename_result(B,m) for B in R)
+  return rename(R,m)
+
+class ResultCache(object): # results of correspond stored in an SQLite file, shared by alpha-equivalent formulas
+  # c = ResultCache("pearl.db"); c.pearl(r"LaTeX formula") returns the first-order correspondent like
+  #   pearl(st,False), but formulas that are equal up to renaming of variables are only computed once
+  #   (for the canonical renaming, so the variable order of the elimination is that of the canonical form)
+  # at most maxsize results are kept on disk (least recently used are removed) and memsize in memory
+  # (lookups answered from memory do not count as a use on disk);
+  # the file is emptied when it was written by a different CACHE_VERSION or version of this file
+  def __init__(self, path=":memory:", maxsize=100000, memsize=1000):
+    import hashlib, pickle, sqlite3
+    self.pickle = pickle
+    self.maxsize = maxsize; self.memsize = memsize
+    self.mem = {} # key -> result, in order of use (most recent last)
+    self.lock = threading.Lock()
+    self.clock = 0 # time of last use, counted in lookups
+    try: src = open(__file__,"rb").read()
+    except (NameError, OSError): src = b""
+    self.version = CACHE_VERSION+":"+hashlib.sha1(src).hexdigest()
+    self.db = sqlite3.connect(path, timeout=60, check_same_thread=False)
+    self.db.execute("PRAGMA journal_mode=WAL") # several processes can read while one writes
+    self.db.execute("PRAGMA synchronous=NORMAL") # a lost result after a crash only costs its recomputation
+    with self.db:
+      self.db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+      self.db.execute("CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, value BLOB, used INTEGER)")
+      row = self.db.execute("SELECT value FROM meta WHERE key='version'").fetchone()
+      if row==None or row[0]!=self.version:
+        self.db.execute("DELETE FROM results")
+        self.db.execute("INSERT OR REPLACE INTO meta VALUES ('version',?)", (self.version,))
+      self.clock = self.db.execute("SELECT COALESCE(MAX(used),0) FROM results").fetchone()[0]
+
+  def lookup(self, key, compute): # result for key, from memory, from disk or computed (and stored)
+    with self.lock:
+      self.clock += 1
+      if key in self.mem:
+        R = self.mem.pop(key)
+        self.mem[key] = R
+        return R
+      row = self.db.execute("SELECT value FROM results WHERE key=?", (key,)).fetchone()
+      if row!=None:
+        R = self.pickle.loads(row[0])
+        with self.db: self.db.execute("UPDATE results SET used=? WHERE key=?", (self.clock,key))
+        self.remember(key, R)
+        return R
+    R = compute() # not locked, so other threads can use the cache meanwhile
+    with self.lock:
+      with self.db:
+        self.db.execute("INSERT OR REPLACE INTO results VALUES (?,?,?)",
+                        (key,self.pickle.dumps(R),self.clock))
+        n = self.db.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+        if n>self.maxsize:
+          self.db.execute("DELETE FROM results WHERE key IN "
+                          "(SELECT key FROM results ORDER BY used LIMIT ?)", (n-self.maxsize,))
+      self.remember(key, R)
+    return R
+
+  def remember(self, key, R): # keep R in memory, forgetting the least recently used result if needed
+    self.mem[key] = R
+    if len(self.mem)>self.memsize: del self.mem[next(iter(self.mem))]
+
+  def correspond(self, st, info=False, search=False, compact=False, split_limit=None, split_budget=None):
+    # cached correspond(st,False,search,compact,split_limit,split_budget)
+    C = canonical(parse(st))
+    if C==None: return correspond(st, False, search, compact, split_limit, split_budget)
+    A, m = C
+    key = repr(A)+"|"+str(search)+("|compact" if compact else "")
+    if split_limit!=None or split_budget!=None: key += "|split "+str(split_limit)+" "+str(split_budget)
+    R = self.lookup(key, lambda: correspond(repr(A), False, search, compact, split_limit, split_budget))
+    return rename_result(R, m)
+
+  def purify(self, st, info=False, search=False): # cached purify(st,False,search)
+    R = self.correspond(st, info, search)
+    return R if type(R)==str else R[0]
+
+  def pearl(self, st, info=False, search=False, compact=False): # cached pearl(st,False,search,compact)
+    R = self.correspond(st, info, search, compact)
+    return R if type(R)==str else R[1]
+
+  def clear(self):
+    with self.lock:
+      self.mem.clear()
+      with self.db: self.db.execute("DELETE FROM results")
+
+  def close(self):
+    self.db.close()
+
+result_caches = {} # path -> ResultCache of this process (see cached_correspond)
+
+def cached_correspond(st, info=False, search=False, path=":memory:", compact=False, split_limit=None,
+                      split_budget=None): # correspond using the cache at path
+  # a module level function, so it can be sent to the worker processes of batch
+  if path not in result_caches: result_caches[path] = ResultCache(path)
+  return result_caches[path].correspond(st, info, search, compact, split_limit, split_budget)
+
+### Prover export ##############################################
+
+# First-order correspondents (output of translate or compactFO) in TPTP FOF and SPASS (DFG) syntax.
+# Frame symbols: R -> r/3, \preceq -> le/2, O -> o/1, ^* -> star/1; the FO variables x_k, y_k become
+# X<k>, Y<k>, and free variables are universally quantified
+
+def prover_var(x): # X, X0, Y12, ... for the FO variable x, x_0, y_{12}, ... (x and y come from \mathbf j, \mathbf n)
+  if x in CONST or not re.fullmatch(r"[xy](_(\d|\{\d+\}))?",x):
+    raise ValueError("not a first-order variable: "+x)
+  return x.replace("_","").replace("{","").replace("}","").upper()
+
+def prover_atom(A, args): # atomic formula or term of A in both syntaxes (args: terms of the arguments)
+  if A.id==RMrel: return "r("+",".join(args)+")"
+  if A.id in (RMle,RMnle): return "le("+",".join(args)+")"
+  if A.id==RMiden: return "o("+args[0]+")"
+  if A.id==RMinvol: return "star("+args[0]+")"
+  return None
+
+def tptp_step(A, S): # TPTP string of A, given the TPTP strings S of its arguments
+  if A.a==():
+    if A.id==TRUE: return "$true"
+    if A.id==FALSE: return "$false"
+    return prover_var(A.id)
+  q = quantifier(A)
+  if q: return "("+("! " if q[0]==All else "? ")+"["+prover_var(q[1])+"] : "+S[0]+")"
+  st = prover_atom(A, S)
+  if st is not None: return "~ "+st if A.id==RMnle else st
+  if A.id==Not: return "~ "+S[0]
+  op = {And:"&", Or:"|", Imp:"=>", Iff:"<=>", Eq:"=", Neq:"!="}.get(A.id)
+  if op is None: raise ValueError("not a first-order formula: "+repr(A))
+  return "("+S[0]+" "+op+" "+S[1]+")"
+
+def spass_step(A, S): # SPASS string of A, given the SPASS strings S of its arguments
+  if A.a==():
+    if A.id==TRUE: return "true"
+    if A.id==FALSE: return "false"
+    return prover_var(A.id)
+  q = quantifier(A)
+  if q: return ("forall" if q[0]==All else "exists")+"(["+prover_var(q[1])+"],"+S[0]+")"
+  st = prover_atom(A, S)
+  if st is not None: return "not("+st+")" if A.id==RMnle else st
+  if A.id==Neq: return "not(equal("+S[0]+","+S[1]+"))"
+  op = {Not:"not", And:"and", Or:"or", Imp:"implies", Iff:"equiv", Eq:"equal"}.get(A.id)
+  if op is None: raise ValueError("not a first-order formula: "+repr(A))
+  return op+"("+",".join(S)+")"
+
+def closure_vars(A): # prover names of the free variables of A, in order x,x_0,x_1,...,y,y_0,...
+  V = [prover_var(x) for x in free_vars(A,{})]
+  return sorted(V, key=lambda v: (v[0],int(v[1:] or -1)))
+
+def tptp(A): # FO formula A in TPTP FOF syntax (universally closed)
+  V = closure_vars(A)
+  st = fold(A, tptp_step)
+  return "! ["+",".join(V)+"] : "+st if V else st
+
+def spass(A): # FO formula A in SPASS syntax (universally closed)
+  V = closure_vars(A)
+  st = fold(A, spass_step)
+  return "forall(["+",".join(V)+"],"+st+")" if V else st
+
+def frame_axioms(): # (name, formula) for the conditions of Routley-Meyer frames used by translate
+  x = [fm("x_"+str(k),[]) for k in range(4)]
+  le = lambda a,b: fm(RMle,[a,b])
+  R = lambda a,b,c: fm(RMrel,[a,b,c])
+  imp = lambda a,b: fm(Imp,[a,b])
+  conj = lambda a,b: fm(And,[a,b])
+  star = lambda a: fm(RMinvol,[a])
+  return [("reflexivity", le(x[1],x[1])),
+    ("transitivity", imp(conj(le(x[1],x[2]),le(x[2],x[3])),le(x[1],x[3]))),
+    ("r_antitone_1", imp(conj(le(x[1],x[2]),R(x[2],x[0],x[3])),R(x[1],x[0],x[3]))),
+    ("r_antitone_2", imp(conj(le(x[1],x[2]),R(x[0],x[2],x[3])),R(x[0],x[1],x[3]))),
+    ("r_monotone_3", imp(conj(R(x[0],x[1],x[2]),le(x[2],x[3])),R(x[0],x[1],x[3]))),
+    ("o_monotone", imp(conj(fm(RMiden,[x[1]]),le(x[1],x[2])),fm(RMiden,[x[2]]))),
+    ("star_antitone", imp(le(x[1],x[2]),le(star(x[2]),star(x[1])))),
+    ("identity", fm(Iff,[le(x[1],x[2]),fm(Exists+" x_3",[conj(fm(RMiden,[x[3]]),R(x[3],x[1],x[2]))])]))]
+
+RM_AXIOMS = frame_axioms() # default header of export; add e.g. ("star_involution", x_1^{**}=x_1) as needed
+
+def correspondent(rec): # FO formula in a result record of pearl or correspond, or the reason it has none
+  if rec["status"]=="ok":
+    R = rec["result"]
+    return R[1] if type(R)==tuple else R
+  return rec["result"] if rec["status"]=="failed" else rec["error"]
+
+def tptp_axioms(axioms): # TPTP lines of the (name, formula) pairs in axioms
+  return "".join("fof("+n+",axiom,"+tptp(B)+").\n" for n,B in axioms)
+
+def spass_header(name, description, axioms): # SPASS (DFG) problem up to its list of conjectures
+  return ("begin_problem("+name+").\n\nlist_of_descriptions.\nname({*"+name+"*}).\nauthor({*PEARL*}).\n"
+    "status(unknown).\ndescription({*"+description.replace("*}","* }")+"*}).\nend_of_list.\n\n"
+    "list_of_symbols.\nfunctions[(star,1)].\npredicates[(r,3),(le,2),(o,1)].\nend_of_list.\n\n"
+    "list_of_formulae(axioms).\n"+"".join("formula("+spass(B)+","+n+").\n" for n,B in axioms)+
+    "end_of_list.\n\nlist_of_formulae(conjectures).\n")
+
+SPASS_END = "end_of_list.\n\nend_problem.\n"
+
+def export(records, path, format="tptp", axioms=RM_AXIOMS, split=False, prefix="pearl_"):
+  # write the correspondents in result records (of batch, pearl_many or correspond) for provers as
+  # they arrive, and return the number written; the k-th record gives the conjecture prefix+k, and
+  # records without a (first-order) correspondent are skipped with a comment
+  # split=False: a single file (path, "-" for standard output, or an open file) with the axioms and all
+  #   conjectures
+  # split=True: path is a directory with a problem file name.p (TPTP, including the shared axiom file
+  #   RM.ax) or name.dfg (SPASS, with the axioms) for each correspondent
+  import sys
+  if split:
+    os.makedirs(path, exist_ok=True)
+    if format=="tptp":
+      with open(os.path.join(path,"RM.ax"),"w") as f: f.write(tptp_axioms(axioms))
+    out = None
+  else:
+    out = path if hasattr(path,"write") else sys.stdout if path=="-" else open(path,"w")
+    if format=="tptp": out.write("% Routley-Meyer frame axioms\n"+tptp_axioms(axioms))
+    else: out.write(spass_header(prefix+"batch","first-order correspondents of PEARL",axioms))
+  n = 0
+  try:
+    for k, rec in enumerate(records, 1):
+      name = prefix+str(k)
+      A = correspondent(rec)
+      try:
+        if type(A)==str: raise ValueError("no correspondent: "+A)
+        st = tptp(A) if format=="tptp" else spass(A)
+      except ValueError as e:
+        if out: out.write("% "+name+": "+rec["input"]+": "+str(e).replace("\n"," ")+"\n")
+        continue
+      if format=="tptp": st = "% "+rec["input"]+"\nfof("+name+",conjecture,"+st+").\n"
+      else: st = "% "+rec["input"]+"\nformula("+st+","+name+").\n"
+      n += 1
+      if out:
+        out.write(st)
+        out.flush()
+      elif format=="tptp":
+        with open(os.path.join(path,name+".p"),"w") as f: f.write("include('RM.ax').\n"+st)
+      else:
+        with open(os.path.join(path,name+".dfg"),"w") as f: f.write(spass_header(name,rec["input"],axioms)+st+SPASS_END)
+    if out and format=="spass": out.write(SPASS_END)
+  finally:
+    if out and out is not path and out is not sys.stdout: out.close()
+  return n
+
+### Finite frames ##############################################
+
+# Correspondents are evaluated on a finite Routley-Meyer frame with points 0,...,n-1 given by NumPy
+# arrays: R (n,n,n) and le (n,n) boolean (for \preceq), O (n,) boolean and star (n,) with the point x^*
+# for each x. Each FO variable of the formula gets an array axis, the value of a subformula is a
+# boolean array over the axes of its free variables (size 1 on the others), and a quantifier is a
+# reduction (all or any) over the axis of its variable. Free variables whose arrays would be too large
+# are given each value in turn instead. numpy is only imported when this is used
+
+def fo_vars(A): # FO variables (free and bound) of the FO formula A, in order of first occurrence
+  V = {}
+  stack = [A]
+  while stack:
+    B = stack.pop()
+    q = quantifier(B)
+    if q: V.setdefault(q[1])
+    elif B.a==() and B.id not in CONST:
+      if B.id[0]=="\\": raise ValueError("not a first-order variable: "+B.id)
+      V.setdefault(B.id)
+    stack += reversed(B.a)
+  return list(V)
+
+def frame_eval(A, R, le, O, star, size=2**22): # generate (values of some free variables, variables of the
+  # array axes, boolean array of the truth values of A over them) for all values of the fixed variables;
+  # bound variables are renamed (rename_bound) so quantifiers with disjoint scopes share an axis, and free
+  # variables are fixed until no subformula has more than size truth values
+  import numpy as np
+  R = np.asarray(R,dtype=bool); le = np.asarray(le,dtype=bool)
+  O = np.asarray(O,dtype=bool); star = np.asarray(star,dtype=np.intp)
+  n = le.shape[0]
+  fv = {}
+  A = rename_bound(A,fv)
+  F = free_vars(A,fv)
+  Ss = set(free_vars(B,fv) for B in subformulas(A)) # variables of the value arrays of the subformulas
+  X = [] # fixed free variables
+  while True:
+    big = [S for S in Ss if n**len(S-set(X))>size]
+    if big==[]: break
+    free = [x for x in F if x not in X and any(x in S for S in big)]
+    if free==[]:
+      raise ValueError("frame_eval: a subformula has more than "+str(size)+" truth values on "+str(n)+
+                       " points even with all free variables of the formula fixed")
+    X.append(max(free,key=lambda x: sum(x in S for S in big))) # the one in most of the large arrays
+  V = [x for x in fo_vars(A) if x not in X]
+  if len(V)>32: raise ValueError("frame_eval: "+str(len(V))+" array axes are needed, more than 32")
+  axis = {x:k for k,x in enumerate(V)}
+  one = (1,)*len(V)
+  tables = {RMrel:R, RMle:le, RMnle:le, RMiden:O}
+  def view(T, B): # T indexed by the arguments of B if they are distinct variables (no copy), else None
+    ks = [axis.get(C.id) for C in B.a]
+    if None in ks or len(set(ks))<len(ks) or any(C.a for C in B.a): return None
+    shape = list(one)
+    for k in ks: shape[k] = n
+    return T.transpose(sorted(range(len(ks)),key=ks.__getitem__)).reshape(shape)
+  fixed = set(X)
+  memo = {}
+  for vals in product(range(n),repeat=len(X)):
+    env = dict(zip(X,vals))
+    def f(B, S): # terms are index arrays of points, formulas boolean arrays
+      if B.a==():
+        if B.id==TRUE: return np.ones(one,dtype=bool)
+        if B.id==FALSE: return np.zeros(one,dtype=bool)
+        if B.id in env: return np.full(one,env[B.id],dtype=np.intp)
+        shape = list(one); shape[axis[B.id]] = n
+        return np.arange(n).reshape(shape)
+      q = quantifier(B)
+      if q: return (np.all if q[0]==All else np.any)(S[0],axis=axis[q[1]],keepdims=True)
+      if B.id==RMinvol: return star[S[0]]
+      if B.id in tables:
+        T = view(tables[B.id],B)
+        if T is None: T = tables[B.id][tuple(S)]
+        return ~T if B.id==RMnle else T
+      if B.id in (Eq,Iff): return S[0]==S[1]
+      if B.id==Neq: return S[0]!=S[1]
+      if B.id==Not: return ~S[0]
+      if B.id==And: return S[0]&S[1]
+      if B.id==Or: return S[0]|S[1]
+      if B.id==Imp: return ~S[0]|S[1]
+      raise ValueError("not a first-order formula: "+repr(B))
+    T = fold(A, f, memo)
+    memo = {B:T for B,T in memo.items() if not free_vars(B,fv)&fixed} # values that do not depend on env
+    yield env, V, T
+
+def frame_valid(A, R, le, O, star, size=2**22): # does the FO formula A hold on the frame for all values of
+  # its free variables
+  if type(A)==str: return A
+  return all(bool(T.all()) for env,V,T in frame_eval(A,R,le,O,star,size))
+
+def frame_counterexample(A, R, le, O, star, size=2**22): # values of the free variables of A where it fails,
+  # or None
+  import numpy as np
+  if type(A)==str: return A
+  fv = free_vars(A,{})
+  for env, V, T in frame_eval(A,R,le,O,star,size):
+    if not T.all():
+      i = np.argwhere(~T)[0]
+      env = dict(env)
+      env.update((x,int(i[k])) for k,x in enumerate(V) if x in fv)
+      return {x:env[x] for x in fo_vars(A) if x in fv}
+  return None
+
+### Finite algebras ############################################
+
+# Input formulas are evaluated on a finite relevance algebra (e.g. a De Morgan monoid) with elements
+# 0,...,n-1 given by NumPy operation tables: a dict with the tables of Meet, Join, Mult, Rimp (n,n) and
+# Invol (n,) and the element Iden (other operations of the signature, e.g. Limp or Galcon, can be added
+# the same way). The order is read off the join table; Top and Bot are its bounds unless given.
+# Assignments of elements to the variables are handled in batches, the value of a subformula being
+# the array of its values for all assignments of the batch
+
+def algebra_tables(ops): # the tables of ops as arrays, with the order le (n,n) and the bounds added
+  import numpy as np
+  T = {k:np.asarray(v) for k,v in ops.items()}
+  n = len(T[Join])
+  T[Le] = T[Join]==np.arange(n) # a\le b iff a\lor b=b
+  for c,ax in ((Top,0),(Bot,1)):
+    if c not in T:
+      B = np.flatnonzero(T[Le].all(axis=ax))
+      if len(B): T[c] = B[0]
+  return T
+
+def algebra_eval(A, ops, size=65536): # generate (assignments, truth values) of the inequality A for
+  # batches of at most size assignments (assignments: one row of elements for each variable in Var order)
+  import numpy as np
+  T = algebra_tables(ops)
+  n = len(T[Join])
+  V = sorted(Var(A))
+  total = n**len(V)
+  for start in range(0, total, size):
+    m = min(size, total-start)
+    if V==[]: X = np.zeros((0,m),dtype=np.intp) # a single empty assignment
+    else: X = np.array(np.unravel_index(np.arange(start,start+m),(n,)*len(V))).reshape(len(V),m)
+    env = dict(zip(V,X))
+    def f(B, S): # element (index) arrays of terms, boolean array of the inequality
+      if B.a==():
+        if B.id in env: return env[B.id]
+        if B.id in T: return T[B.id]
+      elif B.id in T: return T[B.id][tuple(S)]
+      raise ValueError("no table for "+B.id)
+    yield X, np.broadcast_to(fold(A, f),(m,))
+
+def algebra_valid(st, ops, size=65536): # does the formula st (LaTeX or parsed) hold in the algebra ops
+  A = as_inequality(parse(st) if type(st)==str else st)
+  return all(ok.all() for X,ok in algebra_eval(A, ops, size))
+
+def algebra_counterexample(st, ops, size=65536): # assignment of elements to the variables where st fails, or None
+  import numpy as np
+  A = as_inequality(parse(st) if type(st)==str else st)
+  V = sorted(Var(A))
+  for X,ok in algebra_eval(A, ops, size):
+    if not ok.all():
+      i = np.flatnonzero(~ok)[0]
+      return {v:int(X[k,i]) for k,v in enumerate(V)}
+  return None
+
+def frame_algebra(R, le, O, star): # the algebra of up-sets of a finite frame (the "complex algebra")
+  # as tables for algebra_valid; st holds in it iff st is valid on the frame, which is what the
+  # correspondent of st expresses (see frame_valid); the up-sets are enumerated, so n must be small
+  import numpy as np
+  le = np.asarray(le,dtype=bool); n = len(le)
+  R = np.asarray(R,dtype=int); star = np.asarray(star,dtype=np.intp)
+  U = (np.arange(2**n)[:,None]>>np.arange(n)&1).astype(bool) # all subsets, as rows
+  U = U[~np.einsum("ax,ay,xy->a",U,~U,le).astype(bool)] # up-sets: no x\preceq y with x in, y out
+  Ui = U.astype(int)
+  codes = U@(1<<np.arange(n))
+  def index(S): # indices in U of the rows of S
+    k = S.astype(int)@(1<<np.arange(n))
+    i = np.searchsorted(codes,k)
+    if (i>=len(codes)).any() or (codes[np.minimum(i,len(codes)-1)]!=k).any():
+      raise ValueError("the frame does not satisfy the Routley-Meyer conditions")
+    return i
+  mult = np.einsum("by,ayz->abz",Ui,np.einsum("ax,xyz->ayz",Ui,R))>0 # a\circ b: some Rxyz, x in a, y in b
+  rimp = np.einsum("axz,bz->abx",np.einsum("ay,xyz->axz",Ui,R),(~U).astype(int))==0 # a\to b
+  m = len(U)
+  return {Meet:index((U[:,None]&U[None,:]).reshape(m*m,n)).reshape(m,m),
+          Join:index((U[:,None]|U[None,:]).reshape(m*m,n)).reshape(m,m),
+          Mult:index(mult.reshape(m*m,n)).reshape(m,m),
+          Rimp:index(rimp.reshape(m*m,n)).reshape(m,m),
+          Invol:index(~U[:,star]),
+          Iden:index(np.asarray(O,dtype=bool)[None,:])[0]}
+
+### Frame enumeration ##########################################
+
+# Routley-Meyer frames with points 0,...,n-1 (a partial order le, an up-set O, an antitone star and
+# R antitone in its first two and monotone in its third argument, with x\preceq y iff R oxy for some
+# o in O), one for each isomorphism class. The skeleton (le, O, star) is chosen first: le is the
+# smallest of its relabelings, (O, star) the smallest under the automorphisms of le. R is then built
+# by deciding one triple at a time, each decision adding all triples it forces by monotonicity, so
+# no branch ends without a frame; a frame is kept if its R is the smallest under the automorphisms of
+# the skeleton. The number of frames grows very fast with n (the conditions argument of rm_frames,
+# e.g. [pearl(st,False)], keeps only the frames of a logic)
+
+def frame_code(R, le, O, star): # bit array of a frame: le, O, star (one row per point) and R
+  import numpy as np
+  n = len(le)
+  S = np.zeros((n,n),dtype=bool); S[np.arange(n),star] = True
+  return np.concatenate([np.ravel(le),np.ravel(O),S.ravel(),np.ravel(R)]).astype(bool)
+
+def pack_frame(R, le, O, star): # frame as bytes
+  import numpy as np
+  return np.packbits(frame_code(R,le,O,star)).tobytes()
+
+def unpack_frame(b, n): # (R, le, O, star) from the bytes of pack_frame for a frame with n points
+  import numpy as np
+  B = np.unpackbits(np.frombuffer(b,dtype=np.uint8))[:2*n*n+n+n**3].astype(bool)
+  S = B[n*n+n:2*n*n+n].reshape(n,n)
+  return B[2*n*n+n:].reshape(n,n,n), B[:n*n].reshape(n,n), B[n*n:n*n+n], S.argmax(axis=1)
+
+def posets(n): # list of (le, automorphisms) for the partial orders on n points, one for each
+  # isomorphism class; each is its smallest relabeling and only natural labelings (x\preceq y => x<=y)
+  # are tried, permutations are rows p with the point p[x] relabeled x
+  import numpy as np
+  from itertools import permutations
+  P = np.array(list(permutations(range(n))),dtype=np.intp).reshape(-1,n)
+  w = 1<<np.arange(n*n,dtype=np.int64)
+  codes = lambda le: le[P[:,:,None],P[:,None,:]].reshape(len(P),-1)@w # of all relabelings of le
+  pairs = [(x,y) for x in range(n) for y in range(x+1,n)]
+  found = {}
+  for mask in range(2**len(pairs)):
+    le = np.eye(n,dtype=bool)
+    for k,(x,y) in enumerate(pairs): le[x,y] = mask>>k&1
+    if ((le.astype(int)@le>0)&~le).any(): continue # not transitive
+    C = codes(le)
+    c = C.min()
+    if c in found: continue
+    p = P[C.argmin()]
+    le = le[p[:,None],p[None,:]]
+    found[c] = (le, P[codes(le)==c])
+  return list(found.values())
+
+def relabel_star(star, P): # star relabeled by each permutation (row) of P
+  import numpy as np
+  Q = np.argsort(P,axis=1) # Q[x] is the new label of the point x
+  return np.take_along_axis(Q,star[P],axis=1)
+
+def skeletons(n, involution=False): # generate (le, O, star, automorphisms) of the skeletons of frames
+  import numpy as np
+  M = np.array(list(product(range(n),repeat=n)),dtype=np.intp).reshape(-1,n) # all maps
+  for le, A in posets(n):
+    ok = np.ones(len(M),dtype=bool) # antitone maps
+    for x,y in zip(*np.nonzero(le)): ok &= le[M[:,y],M[:,x]]
+    if involution: ok &= (np.take_along_axis(M,M,axis=1)==np.arange(n)).all(axis=1)
+    stars = M[ok]
+    for o in range(1,2**n):
+      O = (o>>np.arange(n)&1).astype(bool)
+      if (le&O[:,None]&~O[None,:]).any(): continue # not an up-set
+      wo = 1<<np.arange(n,dtype=np.int64)
+      if (O[A]@wo<o).any(): continue # a relabeling of O is smaller
+      B = A[O[A]@wo==o]
+      for star in stars:
+        codes = relabel_star(star,B)@(n**np.arange(n,dtype=np.int64))
+        c = star@(n**np.arange(n,dtype=np.int64))
+        if (codes<c).any(): continue
+        yield le, O, star, B[codes==c]
+
+def frame_search(le, O): # the search for R on a skeleton: R and its complement are bit sets of triples
+  # xyz (bit x*n*n+y*n+z); returns (up, down, req, full, zeros) for the search states (R, not R so far)
+  n = len(le)
+  T = [(x,y,z) for x in range(n) for y in range(n) for z in range(n)]
+  # up[t]: triples that are in R if t is, down[t]: triples that are not in R if t is not
+  up = [sum(1<<s for s,(u,v,w) in enumerate(T) if le[u,x] and le[v,y] and le[z,w]) for x,y,z in T]
+  down = [sum(1<<s for s,(u,v,w) in enumerate(T) if le[x,u] and le[y,v] and le[w,z]) for x,y,z in T]
+  zeros = 0
+  req = [] # for x\preceq y, the triples oxy with o in O (one of them must be in R)
+  for x in range(n):
+    for y in range(n):
+      Mxy = sum(1<<(o*n*n+x*n+y) for o in range(n) if O[o])
+      if le[x,y]: req.append(Mxy)
+      else: zeros |= Mxy
+  return up, down, req, (1<<n**3)-1, zeros
+
+def chunks(L, size): # the list L in pieces of at most size elements
+  return [L[i:i+size] for i in range(0,len(L),size)]
+
+def split_search(le, O, depth): # the search states for R after depth decisions (tasks for the pool)
+  up, down, req, full, zeros = frame_search(le, O)
+  states = []
+  stack = [(0,zeros,0)]
+  while stack:
+    ones, zeros, d = stack.pop()
+    if ones&zeros or any(M&~zeros==0 for M in req): continue
+    free = full&~(ones|zeros)
+    if free and d<depth:
+      t = (free&-free).bit_length()-1
+      stack.append((ones,zeros|down[t],d+1))
+      stack.append((ones|up[t],zeros,d+1))
+    else: states.append((ones,zeros))
+  return states
+
+def skeleton_frames(le, O, star, auts, conditions=(), states=None): # packed frames with this skeleton
+  # found from the search states (all if None); a worker task of rm_frames
+  import numpy as np
+  n = len(le)
+  up, down, req, full, zeros = frame_search(le, O)
+  out = []
+  stack = list(reversed(states)) if states is not None else [(0,zeros)]
+  while stack:
+    ones, zeros = stack.pop()
+    if ones&zeros or any(M&~zeros==0 for M in req): continue
+    free = full&~(ones|zeros)
+    if free:
+      t = (free&-free).bit_length()-1
+      stack.append((ones,zeros|down[t]))
+      stack.append((ones|up[t],zeros))
+      continue
+    R = np.unpackbits(np.frombuffer(ones.to_bytes(n**3//8+1,"little"),dtype=np.uint8),
+                      bitorder="little")[:n**3].astype(bool).reshape(n,n,n)
+    if len(auts)>1: # keep R only if no automorphism of the skeleton gives a smaller one
+      P = auts
+      Rs = np.packbits(R[P[:,:,None,None],P[:,None,:,None],P[:,None,None,:]].reshape(len(P),-1),axis=1)
+      c = np.packbits(R.ravel())
+      d = Rs!=c
+      first = d.argmax(axis=1)
+      rows = d.any(axis=1)
+      if (Rs[rows,first[rows]]<c[first[rows]]).any(): continue
+    if all(frame_valid(A,R,le,O,star) for A in conditions): out.append(pack_frame(R,le,O,star))
+  return out
+
+def rm_frames(n, workers=None, conditions=(), involution=False, depth=8): # generate (k, packed frame)
+  # for all frames with k=1,...,n points up to isomorphism (see unpack_frame); conditions are FO
+  # formulas that must hold, involution=True also requires x^{**}=x. The searches for R are split
+  # after depth decisions into tasks for a pool of worker processes, as in batch
+  workers = workers or os.cpu_count() or 1
+  if workers==1:
+    for k in range(1,n+1):
+      for s in skeletons(k,involution):
+        for b in skeleton_frames(*s,conditions): yield k, b
+    return
+  tasks = ((k,s,T) for k in range(1,n+1) for s in skeletons(k,involution)
+           for T in chunks(split_search(s[0],s[1],depth),16))
+  with ProcessPoolExecutor(workers) as pool:
+    pending = deque()
+    for k,s,T in tasks:
+      pending.append((k,pool.submit(skeleton_frames,*s,conditions,T)))
+      if len(pending) >= 4*workers:
+        k, f = pending.popleft()
+        for b in f.result(): yield k, b
+    while pending:
+      k, f = pending.popleft()
+      for b in f.result(): yield k, b
+
+### Command line ###############################################
+
+def correspond(st, info=False, search=False, compact=False, split_limit=None, split_budget=None):
+  # purified form of st and its first-order correspondent
+  As = purify(st, info, search, split_limit=split_limit, split_budget=split_budget)
+  if type(As)==str: return As
+  B = reduce(translate(As))
+  return (As, compactFO(B) if compact else B)
+
+def json_record(rec): # JSON-ready form of a result record of correspond (see run_item)
+  r = {"input":rec["input"], "status":rec["status"], "purified":None, "correspondent":None, "reason":None}
+  if rec["status"]=="ok":
+    As, B = rec["result"]
+    r["purified"] = [[repr(A) for A in Bs] for Bs in As]
+    r["correspondent"] = repr(B)
+  else: r["reason"] = rec["result"] if rec["status"]=="failed" else rec["error"]
+  return r
+
+def main(argv=None): # python -m pearl [file] writes one JSON record per input formula
+  import argparse, json, sys
+  ap = argparse.ArgumentParser(prog="python -m pearl",
+    description="Read one LaTeX formula per line and write one JSON line per formula with its "
+                "purified quasi-inequalities, first-order correspondent, or the reason for failure.")
+  ap.add_argument("file", nargs="?", default="-", help="input file (default: standard input)")
+  ap.add_argument("-o", "--output", default="-", help="output file (default: standard output)")
+  ap.add_argument("-w", "--workers", type=int, default=1, help="number of worker processes (default: 1)")
+  ap.add_argument("-t", "--timeout", type=float, help="time limit in seconds for each formula")
+  ap.add_argument("--chunksize", type=int, default=16, help="formulas sent to a worker at a time")
+  ap.add_argument("--search", choices=["first","best"], help="search mode for elimination (see elim)")
+  ap.add_argument("--cache", help="SQLite file with results of earlier runs (see ResultCache)")
+  ap.add_argument("--compact", action="store_true", help="simplify the correspondents (see compactFO)")
+  ap.add_argument("--split-limit", type=int, help="give up on a formula when splitting produces more "
+                  "inclusions than this")
+  ap.add_argument("--split-budget", type=int, help="give up on a formula when the inclusions produced by "
+                  "splitting have more formula nodes than this")
+  ap.add_argument("--format", choices=["json","tptp","spass"], default="json",
+                  help="write JSON records, or the correspondents as TPTP or SPASS problems (see export)")
+  ap.add_argument("--classify", action="store_true", help="only classify the formulas as Sahlqvist, "
+                  "inductive or non-inductive (see classify), written as JSON records")
+  ap.add_argument("--split", action="store_true", help="with --format tptp/spass: the output is a directory "
+                  "with one problem file per correspondent")
+  args = ap.parse_args(argv)
+  if args.classify and (args.format!="json" or args.split):
+    ap.error("--classify writes JSON records, it cannot be combined with "+
+             ("--split" if args.split else "--format "+args.format))
+  prev = sys.stdout # restored at the end, main can be called with stdout redirected (e.g. in a notebook)
+  inp = sys.stdin if args.file=="-" else open(args.file)
+  out = prev if args.output=="-" or args.format!="json" else open(args.output, "w")
+  sys.stdout = sys.stderr # messages printed during the run must not mix with the records
+  try:
+    lines = (l.strip() for l in inp)
+    formulas = (l for l in lines if l!="" and l[0]!="%") # skip blank lines and LaTeX comments
+    limits = {"split_limit":args.split_limit, "split_budget":args.split_budget}
+    if args.cache: fn = partial(cached_correspond, search=args.search or False, path=args.cache, compact=args.compact,
+                                **limits)
+    else: fn = partial(correspond, search=args.search or False, compact=args.compact, **limits)
+    if args.classify: fn = classify_item
+    records = batch(fn, formulas, args.workers, False, args.timeout, args.chunksize)
+    if args.classify:
+      for rec in records:
+        r = {"input":rec["input"], "status":rec["status"]}
+        r.update(rec["result"] if rec["status"]=="ok" else {"reason":rec["error"]})
+        out.write(json.dumps(r)+"\n")
+        out.flush()
+    elif args.format!="json": # export writes to args.output itself
+      export(records, out if args.output=="-" else args.output, args.format, split=args.split)
+    else:
+      for rec in records:
+        out.write(json.dumps(json_record(rec))+"\n")
+        out.flush()
+  finally:
+    sys.stdout = prev
+    if inp is not sys.stdin: inp.close() # only the files opened here are closed
+    if out is not prev: out.close()
+
+if __name__ == "__main__":
+  main()